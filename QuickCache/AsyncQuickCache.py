@@ -0,0 +1,434 @@
+# -*- coding: UTF-8 -*-
+import os
+import stat
+import asyncio
+import weakref
+import threading
+from redis.asyncio import Redis, ConnectionPool
+from typing import Optional, Any, Tuple, List, Dict, AsyncIterator, Union
+from mio.util.Logs import LogHandler
+from mio.util.Helper import get_root_path, read_txt_file
+from .Logger import get_logger
+from .Serializer import Serializer, NOT_FOUND
+from .PageCodec import encode_page, is_page, parse_head, decode_page, chunk_keys, stale_chunk_keys, HEAD_SIZE, \
+    LUA_UNLINK_STALE_CHUNKS
+
+# 连接池中的连接绑定在创建它的事件循环上，按(事件循环, 地址)共享；事件循环被回收时对应的客户端一起释放
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, Redis]]" = weakref.WeakKeyDictionary()
+_clients_lock = threading.Lock()
+_templates: Dict[Tuple[int, str], Tuple[float, Any]] = {}
+_templates_lock = threading.Lock()
+
+
+def _current_app() -> Any:
+    # 正在quart的应用上下文中时使用quart的应用，否则使用flask的
+    try:
+        import quart
+        if quart.has_app_context():
+            return quart.current_app._get_current_object()
+    except ImportError:
+        pass
+    from flask import current_app
+    return current_app._get_current_object()
+
+
+def _is_quart(app: Any) -> bool:
+    try:
+        from quart import Quart
+    except ImportError:
+        return False
+    return isinstance(app, Quart)
+
+
+class AsyncQuickCache(object):
+    """
+    QuickCache的asyncio版本，接口与QuickCache保持一致，底层使用redis.asyncio的连接池，不会阻塞事件循环。
+    存储格式与QuickCache完全相同，两者可以读写同一份缓存。
+    """
+    VERSION = "0.1"
+    redis_key: str
+    serializer: Serializer
+    page_compressor: Optional[str]
+    page_chunk_size: int
+    redis_url: str
+    max_connections: int
+    app: Any
+    is_quart: bool
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, current_app: Optional[Any] = None, redis_url: Optional[str] = None,
+            serializer: Optional[Serializer] = None, max_connections: int = 64
+    ):
+        # current_app可以是flask或quart的应用；不传入时取当前上下文中的应用，cli下需要显式传入
+        if current_app is None:
+            current_app = _current_app()
+        # 模板渲染等与框架相关的操作按应用的类型区分，而不是按是否安装了quart
+        self.app = current_app
+        self.is_quart = _is_quart(current_app)
+        self.redis_key = current_app.config["REDIS_KEY_PREFIX"]
+        if redis_url is None:
+            redis_url = current_app.config["REDIS_URL"]
+        if serializer is None:
+            serializer = Serializer(
+                serializer=current_app.config.get("QUICK_CACHE_SERIALIZER", None),
+                compressor=current_app.config.get("QUICK_CACHE_COMPRESSOR", None),
+                compress_threshold=current_app.config.get("QUICK_CACHE_COMPRESS_THRESHOLD", 1024)
+            )
+        self.serializer = serializer
+        self.page_compressor = current_app.config.get("QUICK_CACHE_PAGE_COMPRESSOR", "gzip")
+        self.page_chunk_size = current_app.config.get("QUICK_CACHE_PAGE_CHUNK_SIZE", 512 * 1024)
+        self.redis_url = redis_url
+        self.max_connections = max_connections
+
+    @property
+    def redis_db(self) -> Redis:
+        # 实例可以在事件循环之外创建，到第一次使用时才按当前运行的事件循环取得客户端
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        with _clients_lock:
+            clients: Optional[Dict[str, Redis]] = _clients.get(loop)
+            if clients is None:
+                clients = {}
+                _clients[loop] = clients
+            client: Optional[Redis] = clients.get(self.redis_url)
+            if client is None:
+                pool: ConnectionPool = ConnectionPool.from_url(self.redis_url, max_connections=self.max_connections)
+                client = Redis(connection_pool=pool)
+                clients[self.redis_url] = client
+            return client
+
+    def __encode_value__(self, value: Any, is_pickle: bool = True) -> Any:
+        return value if not is_pickle else self.serializer.dumps(value)
+
+    def __decode_value__(self, val: bytes, is_pickle: bool = True) -> Any:
+        if is_pickle:
+            return self.serializer.loads(val)
+        return val.decode("utf-8")
+
+    async def scan_keys(self, key: str, count: int = 500, is_full_key: bool = False) -> AsyncIterator[str]:
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        cursor: int = 0
+        try:
+            while True:
+                cursor, keys = await self.redis_db.scan(cursor=cursor, match=redis_key, count=count)
+                for _k in keys:
+                    yield str(_k, encoding="utf-8") if isinstance(_k, bytes) else _k
+                if int(cursor) == 0:
+                    break
+        except Exception as e:
+            self.__get_logger__("scan_keys").error(e)
+
+    async def get_keys(self, key: str, is_full_key: bool = False, count: int = 500) -> List[str]:
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        keys: Dict[str, None] = {}
+        async for _k in self.scan_keys(redis_key, count=count, is_full_key=True):
+            keys[_k] = None
+        return list(keys)
+
+    async def lpush(
+            self, key: str, value: Optional[Any] = None, expiry: Optional[int] = None, is_full_key: bool = False
+    ) -> bool:
+        if key is None or len(key) <= 0:
+            return False
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            if expiry and expiry > 0:
+                # MULTI保证原子性，EXPIRE NX只在键刚创建（还没有过期时间）时生效
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.lpush(redis_key, self.serializer.dumps(value))
+                pipe.expire(redis_key, time=expiry, nx=True)
+                await pipe.execute()
+            else:
+                await self.redis_db.lpush(redis_key, self.serializer.dumps(value))
+            return True
+        except Exception as e:
+            self.__get_logger__("lpush").error(e)
+            return False
+
+    async def llen(self, key: str, is_full_key: bool = False) -> int:
+        if key is None or len(key) <= 0:
+            return 0
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            return await self.redis_db.llen(redis_key)
+        except Exception as e:
+            self.__get_logger__("llen").error(e)
+            return 0
+
+    async def inc_num(
+            self, key: str, num: int = 1, expiry: Optional[int] = None, is_full_key: bool = False
+    ) -> Optional[int]:
+        if key is None or len(key) <= 0:
+            return None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            if expiry and expiry > 0:
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.incrby(redis_key, num)
+                pipe.expire(redis_key, time=expiry, nx=True)
+                item, _ = await pipe.execute()
+            else:
+                item = await self.redis_db.incr(redis_key, num)
+            return item
+        except Exception as e:
+            self.__get_logger__("inc_num").error(e)
+            return None
+
+    async def dec_num(
+            self, key: str, num: int = 1, expiry: Optional[int] = None, is_full_key: bool = False
+    ) -> Optional[int]:
+        if key is None or len(key) <= 0:
+            return None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            if expiry and expiry > 0:
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.decrby(redis_key, num)
+                pipe.expire(redis_key, time=expiry, nx=True)
+                item, _ = await pipe.execute()
+            else:
+                item = await self.redis_db.decr(redis_key, num)
+            return item
+        except Exception as e:
+            self.__get_logger__("dec_num").error(e)
+            return None
+
+    async def expire(
+            self, key: str, expiry: int, nx: bool = True, xx: bool = False, is_full_key: bool = False
+    ) -> bool:
+        if key is None or len(key) <= 0:
+            return False
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            if expiry <= 0:
+                self.__get_logger__("expire").error("传入的过期时间[{}]为负数或0".format(expiry))
+                return False
+            await self.redis_db.expire(redis_key, time=expiry, nx=nx, xx=xx)
+            return True
+        except Exception as e:
+            self.__get_logger__("expire").error(e)
+            return False
+
+    async def rpop(self, key: str, is_full_key: bool = False) -> Optional[Any]:
+        if key is None or len(key) <= 0:
+            return None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            val: Optional[bytes] = await self.redis_db.rpop(redis_key)
+            if val is None:
+                return None
+            return self.serializer.loads(val)
+        except Exception as e:
+            self.__get_logger__("rpop").error(e)
+            return None
+
+    async def cache(
+            self, key: str, value: Optional[Any] = None, expiry: int = 0, is_full_key: bool = False,
+            is_pickle: bool = True, sliding: bool = False
+    ) -> Tuple[bool, Optional[Any]]:
+        if key is None or len(key) <= 0:
+            return False, None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            if value is None:
+                # 读取
+                val: Optional[bytes]
+                if sliding and expiry > 0:
+                    # 滑动过期：GETEX读取的同时刷新过期时间，只需一次往返
+                    val = await self.redis_db.getex(redis_key, ex=expiry)
+                else:
+                    val = await self.redis_db.get(redis_key)
+                if val and val != NOT_FOUND:
+                    return True, self.__decode_value__(val, is_pickle)
+                return True, None
+            else:
+                # 写入
+                val = self.__encode_value__(value, is_pickle)
+                if expiry > 0:
+                    await self.redis_db.setex(redis_key, expiry, val)
+                else:
+                    await self.redis_db.set(redis_key, val)
+                return True, value
+        except Exception as e:
+            self.__get_logger__("cache").error(e)
+            return False, None
+
+    async def get_many(
+            self, keys: List[str], is_full_key: bool = False, is_pickle: bool = True
+    ) -> Dict[str, Tuple[bool, Optional[Any]]]:
+        result: Dict[str, Tuple[bool, Optional[Any]]] = {}
+        keys = [key for key in keys if key is not None and len(key) > 0]
+        if len(keys) <= 0:
+            return result
+        redis_keys: List[str] = [f"{self.redis_key}:Cache:{key}" if not is_full_key else key for key in keys]
+        try:
+            values: List[Optional[bytes]] = await self.redis_db.mget(redis_keys)
+        except Exception as e:
+            self.__get_logger__("get_many").error(e)
+            return {key: (False, None) for key in keys}
+        for key, val in zip(keys, values):
+            if not val or val == NOT_FOUND:
+                result[key] = (True, None)
+                continue
+            try:
+                result[key] = (True, self.__decode_value__(val, is_pickle))
+            except Exception as e:
+                self.__get_logger__("get_many").error(e)
+                result[key] = (False, None)
+        return result
+
+    async def set_many(
+            self, mapping: Dict[str, Any], expiry: int = 0, is_full_key: bool = False, is_pickle: bool = True
+    ) -> bool:
+        if mapping is None or len(mapping) <= 0:
+            return False
+        try:
+            pipe = self.redis_db.pipeline(transaction=False)
+            for key, value in mapping.items():
+                if key is None or len(key) <= 0 or value is None:
+                    continue
+                redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+                val = self.__encode_value__(value, is_pickle)
+                if expiry > 0:
+                    pipe.setex(redis_key, expiry, val)
+                else:
+                    pipe.set(redis_key, val)
+            await pipe.execute()
+            return True
+        except Exception as e:
+            self.__get_logger__("set_many").error(e)
+            return False
+
+    async def remove_cache(self, key: str, is_full_key: bool = False):
+        if key is None or len(key) <= 0:
+            return
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            await self.redis_db.delete(redis_key)
+        except Exception as e:
+            self.__get_logger__("remove_cache").debug(e)
+
+    async def __unlink_keys__(self, keys: List[str]) -> int:
+        pipe = self.redis_db.pipeline(transaction=False)
+        for _k in keys:
+            pipe.unlink(_k)
+        return sum(await pipe.execute())
+
+    async def bulk_remove_cache(self, key: str, is_full_key: bool = False, batch_size: int = 500) -> int:
+        if key is None or len(key) <= 0:
+            return 0
+        redis_key: str = f"{self.redis_key}:Cache:{key}:*" if not is_full_key else key
+        removed: int = 0
+        try:
+            batch: List[str] = []
+            async for _k in self.scan_keys(redis_key, count=batch_size, is_full_key=True):
+                batch.append(_k)
+                if len(batch) >= batch_size:
+                    removed += await self.__unlink_keys__(batch)
+                    batch = []
+            if len(batch) > 0:
+                removed += await self.__unlink_keys__(batch)
+        except Exception as e:
+            self.__get_logger__("bulk_remove_cache").debug(e)
+        return removed
+
+    @staticmethod
+    def __get_template__(jinja_env: Any, template_filename: str) -> Optional[Any]:
+        # 与QuickCache相同，编译好的模板按文件名和修改时间缓存在进程内；会读文件，需要放到线程池中执行
+        try:
+            file_stat: os.stat_result = os.stat(template_filename)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        cache_key: Tuple[int, str] = (id(jinja_env), template_filename)
+        with _templates_lock:
+            item: Optional[Tuple[float, Any]] = _templates.get(cache_key)
+        if item is not None and item[0] == file_stat.st_mtime:
+            return item[1]
+        template = jinja_env.from_string(read_txt_file(template_filename))
+        with _templates_lock:
+            _templates[cache_key] = (file_stat.st_mtime, template)
+        return template
+
+    async def __render_template__(self, template_filename: str, **kwargs) -> Optional[str]:
+        # quart下渲染是协程，flask下则直接同步渲染；两者都与render_template_string一样注入上下文处理器提供的变量
+        template = await asyncio.get_running_loop().run_in_executor(
+            None, self.__get_template__, self.app.jinja_env, template_filename)
+        if template is None:
+            return None
+        context: Dict[str, Any] = dict(kwargs)
+        if self.is_quart:
+            await self.app.update_template_context(context)
+            return await template.render_async(context)
+        self.app.update_template_context(context)
+        return template.render(context)
+
+    async def __store_page__(self, redis_key: str, text: str, expiry: int):
+        head, chunks = encode_page(text, self.page_compressor, self.page_chunk_size)
+        # 分块和头部在同一个事务中写入，读取方不会看到只写了一半的页面
+        pipe = self.redis_db.pipeline(transaction=True)
+        for _k, chunk in zip(chunk_keys(redis_key, head), chunks):
+            if expiry > 0:
+                pipe.setex(_k, expiry, chunk)
+            else:
+                pipe.set(_k, chunk)
+        # 分块的键名带有代数，不会覆盖正在被读取的旧分块；同时取回旧头部，用来找出需要删除的旧分块
+        pipe.set(redis_key, head, ex=expiry if expiry > 0 else None, get=True)
+        old_head: Optional[bytes] = (await pipe.execute())[-1]
+        # 清理被替换掉的旧分块；期间其他进程又写回了旧的那一份时保留
+        generation, stale = stale_chunk_keys(redis_key, old_head, head)
+        if len(stale) > 0:
+            await self.redis_db.eval(LUA_UNLINK_STALE_CHUNKS, 1 + len(stale), redis_key, *stale, HEAD_SIZE, generation)
+
+    async def __load_page__(self, redis_key: str, expiry: int, gzipped: bool) -> Optional[Union[str, bytes]]:
+        head: Optional[bytes]
+        if expiry > 0:
+            head = await self.redis_db.getex(redis_key, ex=expiry)
+        else:
+            head = await self.redis_db.get(redis_key)
+        if not head or not is_page(head):
+            return None
+        compression, chunk_count, data = parse_head(head)
+        if chunk_count > 0:
+            # 按头部中的代数读取分块，头部被其他进程替换时旧分块要么还在，要么已被删除（视为未命中），不会拼出混合的数据
+            keys: List[str] = chunk_keys(redis_key, head)
+            pipe = self.redis_db.pipeline(transaction=False)
+            pipe.mget(keys)
+            if expiry > 0:
+                for _k in keys:
+                    pipe.expire(_k, expiry)
+            chunks: List[Optional[bytes]] = (await pipe.execute())[0]
+            if any(chunk is None for chunk in chunks):
+                return None
+            data = b"".join(chunks)
+        return decode_page(compression, data, gzipped)
+
+    async def cache_page(
+            self, key: str, template_filename: str, expiry: int = 3600, is_full_key: bool = False, **kwargs
+    ) -> Optional[str]:
+        redis_key: str = f"{self.redis_key}:Page:Cache:{key}" if not is_full_key else key
+        root_path: str = os.path.join(get_root_path(), "web", "template")
+        template_filename = root_path + os.path.sep + template_filename
+        # 开始渲染，读取和编译模板都在线程池中进行，不阻塞事件循环
+        text: Optional[str] = await self.__render_template__(template_filename, **kwargs)
+        if text is None:
+            return None
+        try:
+            await self.__store_page__(redis_key, text, expiry)
+        except Exception as e:
+            self.__get_logger__("cache_page").error(e)
+        return text
+
+    async def read_page(
+            self, key: str, expiry: int = 3600, is_full_key: bool = False, gzipped: bool = False
+    ) -> Optional[Union[str, bytes]]:
+        redis_key: str = f"{self.redis_key}:Page:Cache:{key}" if not is_full_key else key
+        try:
+            # 读取的同时刷新缓存的过期时间，不再重新上传整个页面
+            return await self.__load_page__(redis_key, expiry, gzipped)
+        except Exception as e:
+            self.__get_logger__("read_page").error(e)
+            return None
@@ -0,0 +1,199 @@
+# -*- coding: UTF-8 -*-
+import os
+import sys
+import json
+import time
+import socket
+import random
+import shutil
+import argparse
+import platform
+import subprocess
+from flask import Flask
+from typing import Optional, Any, Tuple, List, Dict, Callable
+from . import QuickCache
+
+# 用法：python -m plugins.QuickCache.Benchmark --output result.json
+# 默认启动一个临时的redis-server，没有安装时使用fakeredis；结果以json输出，便于在版本之间比较
+PAYLOAD_SIZES: Tuple[int, ...] = (64, 1024, 16 * 1024, 64 * 1024)
+KEY_COUNTS: Tuple[int, ...] = (10, 100, 1000)
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_redis_server(redis_server: str = "redis-server") -> Tuple[subprocess.Popen, int]:
+    """
+    启动一个不做持久化的临时redis-server，返回(进程, 端口)
+    """
+    port: int = _free_port()
+    process: subprocess.Popen = subprocess.Popen(
+        [redis_server, "--port", str(port), "--save", "", "--appendonly", "no"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline: float = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.1):
+                return process, port
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("redis-server启动超时")
+
+
+def make_client(backend: str, redis_server: str) -> Tuple[Any, str, Optional[subprocess.Popen]]:
+    """
+    返回(redis客户端, 实际使用的后端, redis-server进程)
+    """
+    if backend in ("auto", "redis-server") and shutil.which(redis_server) is not None:
+        from redis import Redis
+        process, port = start_redis_server(redis_server)
+        return Redis(host="127.0.0.1", port=port), "redis-server", process
+    if backend == "redis-server":
+        raise RuntimeError(f"找不到[{redis_server}]")
+    import fakeredis
+    return fakeredis.FakeRedis(), "fakeredis", None
+
+
+def _payload(size: int, seed: int) -> bytes:
+    # 固定种子，每次运行使用相同的数据
+    return random.Random(seed).getrandbits(size * 8).to_bytes(size, "big")
+
+
+def _percentile(samples: List[int], percent: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * percent))] / 1000
+
+
+def measure(
+        name: str, fn: Callable[[int], Any], iterations: int, setup: Optional[Callable[[int], Any]] = None,
+        **labels
+) -> Dict[str, Any]:
+    """
+    调用fn(i) iterations次并统计延迟（微秒）；setup(i)在每次调用之前执行，不计入耗时
+    """
+    samples: List[int] = []
+    for i in range(iterations):
+        if setup is not None:
+            setup(i)
+        start: int = time.perf_counter_ns()
+        fn(i)
+        samples.append(time.perf_counter_ns() - start)
+    samples.sort()
+    total: int = sum(samples)
+    return {
+        "name": name,
+        **labels,
+        "iterations": iterations,
+        "ops_per_sec": iterations / (total / 1e9) if total > 0 else 0.0,
+        "mean_us": total / iterations / 1000,
+        "p50_us": _percentile(samples, 0.5),
+        "p95_us": _percentile(samples, 0.95),
+        "p99_us": _percentile(samples, 0.99),
+    }
+
+
+def run(
+        quick_cache: QuickCache, iterations: int = 1000, payload_sizes: Tuple[int, ...] = PAYLOAD_SIZES,
+        key_counts: Tuple[int, ...] = KEY_COUNTS, seed: int = 42
+) -> List[Dict[str, Any]]:
+    redis_db: Any = quick_cache.redis_db
+    prefix: str = f"{quick_cache.redis_key}:Cache"
+    results: List[Dict[str, Any]] = []
+    for size in payload_sizes:
+        value: bytes = _payload(size, seed)
+        # 直接访问redis作为基准，与cache的差值就是QuickCache自身的开销
+        raw: bytes = quick_cache.serializer.dumps(value)
+        redis_db.set(f"{prefix}:Bench:Raw", raw)
+        results.append(measure(
+            "raw_get", lambda i: redis_db.get(f"{prefix}:Bench:Raw"), iterations, payload=size))
+        results.append(measure(
+            "cache_set", lambda i: quick_cache.cache(f"Bench:Value:{i}", value), iterations, payload=size))
+        results.append(measure(
+            "cache_get", lambda i: quick_cache.cache(f"Bench:Value:{i}"), iterations, payload=size))
+        results.append(measure(
+            "cache_get_miss", lambda i: quick_cache.cache(f"Bench:Missing:{i}"), iterations, payload=size))
+        results.append(measure(
+            "lpush", lambda i: quick_cache.lpush("Bench:List", value), iterations, payload=size))
+        results.append(measure(
+            "rpop", lambda i: quick_cache.rpop("Bench:List"), iterations, payload=size))
+        page: str = value.hex()
+        quick_cache.__store_page__(f"{quick_cache.redis_key}:Page:Cache:Bench", page, 0)
+        results.append(measure(
+            "read_page", lambda i: quick_cache.read_page("Bench", expiry=0), iterations, payload=len(page)))
+        results.append(measure(
+            "read_page_gzipped", lambda i: quick_cache.read_page("Bench", expiry=0, gzipped=True), iterations,
+            payload=len(page)))
+        for count in key_counts:
+            keys: List[str] = [f"Bench:Value:{i}" for i in range(count)]
+            quick_cache.set_many({key: value for key in keys})
+            rounds: int = max(1, iterations // count)
+            results.append(measure(
+                "get_many", lambda i: quick_cache.get_many(keys), rounds, payload=size, keys=count))
+            results.append(measure(
+                "set_many", lambda i: quick_cache.set_many({key: value for key in keys}), rounds, payload=size,
+                keys=count))
+            results.append(measure(
+                "bulk_remove_cache", lambda i: quick_cache.bulk_remove_cache(f"Bench:Bulk:{i}"), rounds,
+                setup=lambda i: quick_cache.set_many({f"Bench:Bulk:{i}:{key}": value for key in keys}),
+                payload=size, keys=count))
+        quick_cache.bulk_remove_cache("Bench")
+    results.append(measure("inc_num", lambda i: quick_cache.inc_num("Bench:Counter"), iterations))
+    results.append(measure(
+        "inc_num_expiry", lambda i: quick_cache.inc_num("Bench:Counter:Expiry", expiry=60), iterations))
+    results.append(measure(
+        "inc_num_buffered", lambda i: quick_cache.inc_num_buffered("Bench:Counter:Buffered"), iterations))
+    quick_cache.flush_counters()
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="QuickCache性能测试")
+    parser.add_argument("--backend", choices=("auto", "redis-server", "fakeredis"), default="auto")
+    parser.add_argument("--redis-server", default="redis-server", help="redis-server可执行文件的路径")
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--payload-sizes", type=int, nargs="+", default=list(PAYLOAD_SIZES))
+    parser.add_argument("--key-counts", type=int, nargs="+", default=list(KEY_COUNTS))
+    parser.add_argument("--serializer", default=None, help="同QUICK_CACHE_SERIALIZER")
+    parser.add_argument("--compressor", default=None, help="同QUICK_CACHE_COMPRESSOR")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="结果写入的json文件，默认输出到标准输出")
+    args = parser.parse_args(argv)
+    client, backend, process = make_client(args.backend, args.redis_server)
+    try:
+        app: Flask = Flask(__name__)
+        app.config.update(
+            REDIS_KEY_PREFIX=f"QuickCacheBenchmark{os.getpid()}", QUICK_CACHE_SERIALIZER=args.serializer,
+            QUICK_CACHE_COMPRESSOR=args.compressor, QUICK_CACHE_COUNTER_FLUSH_ON_EXIT=False)
+        quick_cache: QuickCache = QuickCache(current_app=app, redis_client=client)
+        # fakeredis没有实现INFO
+        info: Dict[str, Any] = client.info("server") if backend == "redis-server" else {}
+        report: Dict[str, Any] = {
+            "quick_cache": QuickCache.VERSION,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "backend": backend,
+            "redis": info.get("redis_version"),
+            "serializer": args.serializer,
+            "compressor": args.compressor,
+            "seed": args.seed,
+            "results": run(
+                quick_cache, args.iterations, tuple(args.payload_sizes), tuple(args.key_counts), args.seed),
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+    output: str = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+# -*- coding: UTF-8 -*-
+import math
+import time
+import hashlib
+import threading
+from typing import Optional, Any, List, Dict, Iterable
+
+# 置位；重建期间同时记入日志位图，重建结束时合并进新的位图，避免丢失重建期间写入的键
+LUA_ADD = """
+local rebuilding = redis.call('EXISTS', KEYS[2]) == 1
+for i = 1, #ARGV do
+    redis.call('SETBIT', KEYS[1], ARGV[i], 1)
+    if rebuilding then
+        redis.call('SETBIT', KEYS[3], ARGV[i], 1)
+    end
+end
+return 0
+"""
+
+
+class BloomFilter(object):
+    """
+    保存在redis位图中的布隆过滤器，进程内保留一份镜像，用来在本地判断某个键“一定没有缓存”，省去一次往返。
+    位图的位序与redis的SETBIT/GETBIT一致（偏移0是第一个字节的最高位），镜像每隔refresh_interval秒重新拉取一次。
+    布隆过滤器无法删除，过期和删除的键会让误判率逐渐升高，需要定期调用rebuild重建。
+    镜像最多落后refresh_interval秒，其他进程在这期间写入的键可能被判断为不存在，因此只能用在读不到就重新计算的场景。
+    """
+    redis_db: Any
+    redis_key: str
+    capacity: int
+    error_rate: float
+    refresh_interval: float
+    size: int
+    hash_count: int
+    checks: int = 0
+    skipped: int = 0
+    false_positives: int = 0
+
+    def __init__(
+            self, redis_client: Any, redis_key: str, capacity: int, error_rate: float = 0.01,
+            refresh_interval: float = 60
+    ):
+        if capacity <= 0 or not 0 < error_rate < 1:
+            raise ValueError("capacity必须大于0，error_rate必须在0~1之间")
+        self.redis_db = redis_client
+        self.redis_key = redis_key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        # m = -n*ln(p)/ln(2)^2，k = m/n*ln(2)；位数向上取整到字节
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2) / 8)) * 8
+        self.hash_count = max(1, int(round(self.size / capacity * math.log(2))))
+        # 重建完成后才写入就绪标记，之前写入的键不在位图中，未就绪时不做判断
+        self.ready_key = f"{redis_key}:Ready"
+        # 重建时先写入临时键再RENAME；重建标记存在期间的写入同时记入日志位图
+        self.rebuilding_key = f"{redis_key}:Rebuilding"
+        self.journal_key = f"{redis_key}:Journal"
+        self.temp_key = f"{redis_key}:Temp"
+        self._bits: Optional[bytearray] = None
+        self._loaded_at: float = 0
+        self._lock = threading.Lock()
+        self._loading = threading.Lock()
+
+    def __positions__(self, key: str) -> List[int]:
+        # 双重哈希：用一次md5得到两个64位的值，组合出k个位置
+        digest: bytes = hashlib.md5(key.encode("utf-8")).digest()
+        h1: int = int.from_bytes(digest[:8], "big")
+        h2: int = int.from_bytes(digest[8:], "big") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    @staticmethod
+    def __test__(bits: bytearray, position: int) -> bool:
+        return bits[position >> 3] & (0x80 >> (position & 7)) != 0
+
+    def refresh(self) -> bool:
+        """
+        从redis重新拉取位图，返回过滤器是否可用
+        """
+        pipe = self.redis_db.pipeline(transaction=False)
+        pipe.exists(self.ready_key)
+        pipe.get(self.redis_key)
+        is_ready, data = pipe.execute()
+        bits: Optional[bytearray] = None
+        if is_ready:
+            bits = bytearray(self.size // 8)
+            if data:
+                bits[:min(len(data), len(bits))] = data[:len(bits)]
+        with self._lock:
+            self._bits = bits
+            self._loaded_at = time.monotonic()
+        return bits is not None
+
+    def __get_bits__(self) -> Optional[bytearray]:
+        if time.monotonic() - self._loaded_at >= self.refresh_interval:
+            # 只让一个线程去拉取，其他线程继续使用旧的镜像
+            if self._loading.acquire(blocking=False):
+                try:
+                    self.refresh()
+                except Exception:
+                    # redis暂时不可用时沿用旧镜像，下次再试
+                    self._loaded_at = time.monotonic()
+                finally:
+                    self._loading.release()
+        return self._bits
+
+    def might_contain(self, key: str) -> bool:
+        """
+        返回False时键一定没有写入过；镜像还没有就绪时总是返回True
+        """
+        bits: Optional[bytearray] = self.__get_bits__()
+        if bits is None:
+            return True
+        positions: List[int] = self.__positions__(key)
+        with self._lock:
+            self.checks += 1
+            for position in positions:
+                if not self.__test__(bits, position):
+                    self.skipped += 1
+                    return False
+        return True
+
+    def add(self, *keys: str, pipe: Any = None):
+        """
+        传入pipe时只把SETBIT加入到该pipeline中，由调用方执行，可以与写入缓存合并为一次往返
+        """
+        positions: List[int] = [position for key in keys for position in self.__positions__(key)]
+        with self._lock:
+            if self._bits is not None:
+                for position in positions:
+                    self._bits[position >> 3] |= 0x80 >> (position & 7)
+        own_pipe: bool = pipe is None
+        if own_pipe:
+            pipe = self.redis_db.pipeline(transaction=False)
+        pipe.eval(LUA_ADD, 3, self.redis_key, self.rebuilding_key, self.journal_key, *positions)
+        if own_pipe:
+            pipe.execute()
+
+    def report_false_positive(self):
+        with self._lock:
+            self.false_positives += 1
+
+    def rebuild(self, keys: Iterable[str], timeout: float = 600) -> int:
+        """
+        按传入的键重新生成位图并标记为就绪，返回写入的键数量。
+        keys需要是惰性的（例如SCAN），在设置重建标记之后才开始遍历；遍历期间写入的键记在日志位图中，最后一起合并。
+        timeout为重建标记的有效期，重建中途退出时标记自动失效。
+        """
+        pipe = self.redis_db.pipeline(transaction=True)
+        pipe.delete(self.journal_key)
+        pipe.set(self.rebuilding_key, 1, px=int(timeout * 1000))
+        pipe.execute()
+        bits: bytearray = bytearray(self.size // 8)
+        count: int = 0
+        for key in keys:
+            for position in self.__positions__(key):
+                bits[position >> 3] |= 0x80 >> (position & 7)
+            count += 1
+        pipe = self.redis_db.pipeline(transaction=True)
+        pipe.set(self.temp_key, bytes(bits))
+        pipe.bitop("OR", self.temp_key, self.temp_key, self.journal_key)
+        pipe.rename(self.temp_key, self.redis_key)
+        pipe.delete(self.journal_key)
+        pipe.delete(self.rebuilding_key)
+        pipe.set(self.ready_key, 1)
+        pipe.execute()
+        self.refresh()
+        with self._lock:
+            self.false_positives = 0
+            self.skipped = 0
+            self.checks = 0
+        return count
+
+    def clear(self):
+        self.redis_db.delete(self.redis_key, self.ready_key, self.journal_key, self.rebuilding_key)
+        with self._lock:
+            self._bits = None
+            self._loaded_at = 0
+
+    def stats(self) -> Dict[str, Any]:
+        bits: Optional[bytearray] = self._bits
+        # 按位图中已置位的比例估算当前的理论误判率
+        fill: float = bin(int.from_bytes(bits, "big")).count("1") / self.size if bits is not None else 0.0
+        with self._lock:
+            # 实际误判率：本地判断可能存在、但redis中没有的比例
+            negatives: int = self.skipped + self.false_positives
+            return {
+                "ready": bits is not None,
+                "size": self.size,
+                "hash_count": self.hash_count,
+                "checks": self.checks,
+                "skipped": self.skipped,
+                "false_positives": self.false_positives,
+                "false_positive_rate": self.false_positives / negatives if negatives > 0 else 0.0,
+                "estimated_false_positive_rate": fill ** self.hash_count,
+                "fill_ratio": fill,
+            }
@@ -0,0 +1,153 @@
+# -*- coding: UTF-8 -*-
+import time
+import inspect
+import threading
+import redis
+from redis import Redis, ConnectionPool
+from typing import Optional, List, Any
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+from .LocalCache import LocalCache
+
+
+class ClientTracking(object):
+    """
+    基于redis 6+ 的 CLIENT TRACKING（RESP2 REDIRECT + BCAST 模式）为一级缓存提供服务端失效通知。
+    BCAST 模式按前缀广播，不依赖是哪条连接读过这个键，因此可以与连接池配合使用。
+    与redis断开期间一级缓存会被清空并停用，重新建立跟踪后才会恢复，避免读到过期数据。
+    RESP3下失效通知以push帧发送，不会出现在__redis__:invalidate频道中，因此跟踪使用的两条连接总是以RESP2建立。
+    """
+    INVALIDATE_CHANNEL = "__redis__:invalidate"
+    redis_client: Any
+    local_cache: LocalCache
+    prefixes: List[str]
+    retry_interval: float
+    heartbeat_interval: float
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, redis_client: Any, local_cache: LocalCache, prefixes: List[str], retry_interval: float = 1.0,
+            heartbeat_interval: float = 30.0
+    ):
+        self.redis_client = redis_client
+        self.local_cache = local_cache
+        self.prefixes = prefixes
+        self.retry_interval = retry_interval
+        self.heartbeat_interval = heartbeat_interval
+        self._pubsub = None
+        self._tracking_conn = None
+        self._tracking_client: Any = None
+        self._last_heartbeat: float = 0.0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # 建立跟踪之前不允许使用一级缓存
+        self.local_cache.enabled = False
+
+    @property
+    def is_active(self) -> bool:
+        return self._tracking_conn is not None
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self.__run__, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.retry_interval + 1)
+        self.__disconnect__()
+
+    def __get_tracking_client__(self) -> Any:
+        # 按原客户端的连接参数另建一个RESP2的连接池，redis-py 5之前只支持RESP2，不需要指定
+        if self._tracking_client is None:
+            pool = self.redis_client.connection_pool
+            # 连接池自身附带的维护通知处理只支持RESP3，不复制到新的连接池
+            kwargs = {
+                key: value for key, value in pool.connection_kwargs.items()
+                if not key.startswith("maint_notifications")
+            }
+            if int(redis.__version__.split(".")[0]) >= 5:
+                kwargs["protocol"] = 2
+            self._tracking_client = Redis(connection_pool=ConnectionPool(
+                connection_class=pool.connection_class, max_connections=2, **kwargs))
+        return self._tracking_client
+
+    def __connect__(self):
+        client = self.__get_tracking_client__()
+        pubsub = client.pubsub(ignore_subscribe_messages=True)
+        # 订阅之前先拿到这条连接的id，订阅后的连接无法再执行CLIENT命令
+        pubsub.connection = pubsub.connection_pool.get_connection("pubsub")
+        pubsub.connection.send_command("CLIENT", "ID")
+        client_id: int = pubsub.connection.read_response()
+        pubsub.subscribe(self.INVALIDATE_CHANNEL)
+        self._pubsub = pubsub
+        args: List[Any] = ["CLIENT", "TRACKING", "ON", "REDIRECT", client_id, "BCAST"]
+        for prefix in self.prefixes:
+            args.extend(["PREFIX", prefix])
+        # 跟踪状态绑定在连接上，所以这条连接需要一直持有，不能还给连接池
+        conn = client.connection_pool.get_connection("CLIENT")
+        if str(getattr(conn, "protocol", 2)) != "2":
+            # 不能收到失效通知时不能启用一级缓存
+            client.connection_pool.release(conn)
+            raise RuntimeError("CLIENT TRACKING需要RESP2连接")
+        conn.send_command(*args)
+        conn.read_response()
+        self._tracking_conn = conn
+        self._last_heartbeat = time.monotonic()
+        self.local_cache.clear()
+        self.local_cache.enabled = True
+
+    def __disconnect__(self):
+        self.local_cache.enabled = False
+        self.local_cache.clear()
+        if self._tracking_conn is not None:
+            try:
+                self._tracking_conn.disconnect()
+                self._tracking_client.connection_pool.release(self._tracking_conn)
+            except Exception:
+                pass
+            self._tracking_conn = None
+        if self._pubsub is not None:
+            try:
+                self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+
+    def __heartbeat__(self):
+        # 跟踪连接长时间空闲可能被服务端断开，定期ping一下
+        if time.monotonic() - self._last_heartbeat < self.heartbeat_interval:
+            return
+        self._tracking_conn.send_command("PING")
+        self._tracking_conn.read_response()
+        self._last_heartbeat = time.monotonic()
+
+    def __invalidate__(self, data: Optional[List[bytes]]):
+        # data为空表示服务端执行了FLUSHALL/FLUSHDB
+        if data is None:
+            self.local_cache.clear()
+            return
+        if isinstance(data, (bytes, str)):
+            data = [data]
+        self.local_cache.delete(*[str(key, encoding="utf-8") if isinstance(key, bytes) else key for key in data])
+
+    def __run__(self):
+        console_log = self.__get_logger__(inspect.stack()[0].function)
+        while not self._stopped.is_set():
+            try:
+                if self._pubsub is None:
+                    self.__connect__()
+                    console_log.debug("已开启CLIENT TRACKING")
+                message = self._pubsub.get_message(timeout=1.0)
+                if message is not None and message["type"] == "message":
+                    self.__invalidate__(message["data"])
+                self.__heartbeat__()
+            except Exception as e:
+                console_log.error(e)
+                self.__disconnect__()
+                self._stopped.wait(self.retry_interval)
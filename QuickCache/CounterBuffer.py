@@ -0,0 +1,127 @@
+# -*- coding: UTF-8 -*-
+import time
+import atexit
+import threading
+from typing import Optional, Any, List, Dict, Callable
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+
+
+class CounterBuffer(object):
+    """
+    写回式计数器：增量先在进程内累加，由后台线程每隔flush_interval秒通过一个pipeline批量INCRBY写入redis。
+    待写入的键数量达到max_keys，或者未写入的增量总和（绝对值）达到max_loss时立即写入，max_loss即进程崩溃时最多丢失的计数。
+    写入失败的增量会合并回缓冲区，之后的flush_interval秒内只由后台线程重试，不再因为达到上限而在调用方线程中同步写入。
+    """
+    redis_db: Any
+    flush_interval: float
+    max_keys: int
+    max_loss: int
+    prepare: Optional[Callable[[Any, str], None]]
+    flushed: Optional[Callable[[List[str]], None]]
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, redis_client: Any, flush_interval: float = 5, max_keys: int = 1000, max_loss: int = 0,
+            flush_on_exit: bool = True, prepare: Optional[Callable[[Any, str], None]] = None,
+            flushed: Optional[Callable[[List[str]], None]] = None
+    ):
+        self.redis_db = redis_client
+        self.flush_interval = flush_interval
+        self.max_keys = max_keys
+        self.max_loss = max_loss
+        # 写入每个键之前调用，可以往同一个pipeline中追加其他命令
+        self.prepare = prepare
+        # 写入成功后传入写入的键，用于让一级缓存中的旧值失效
+        self.flushed = flushed
+        # redis_key -> [增量, 过期时间]
+        self._pending: Dict[str, List[int]] = {}
+        self._pending_total: int = 0
+        # 写入失败后到这个时间之前不在add中触发写入
+        self._backoff_until: float = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        if flush_on_exit:
+            atexit.register(self.close)
+
+    def __start__(self):
+        # 调用方需要持有锁
+        if self._thread is not None or self._stop.is_set():
+            return
+        self._thread = threading.Thread(target=self.__run__, name=self.__class__.__name__, daemon=True)
+        self._thread.start()
+
+    def __run__(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def add(self, redis_key: str, num: int, expiry: Optional[int] = None):
+        with self._lock:
+            item: Optional[List[int]] = self._pending.get(redis_key)
+            if item is None:
+                self._pending[redis_key] = [num, expiry or 0]
+            else:
+                item[0] += num
+                if expiry:
+                    item[1] = expiry
+            self._pending_total += abs(num)
+            need_flush: bool = (len(self._pending) >= self.max_keys or 0 < self.max_loss <= self._pending_total) \
+                and time.monotonic() >= self._backoff_until
+            self.__start__()
+        if need_flush:
+            self.flush()
+
+    def pending(self, redis_key: str) -> int:
+        """
+        返回还没有写入redis的增量，读取时加上它就是最新的值
+        """
+        with self._lock:
+            item: Optional[List[int]] = self._pending.get(redis_key)
+            return item[0] if item is not None else 0
+
+    def flush(self) -> int:
+        """
+        把缓冲区中的增量写入redis，返回写入的键数量
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending: Dict[str, List[int]] = self._pending
+                self._pending = {}
+                self._pending_total = 0
+            pending = {redis_key: item for redis_key, item in pending.items() if item[0] != 0}
+            if len(pending) <= 0:
+                return 0
+            try:
+                pipe = self.redis_db.pipeline(transaction=False)
+                for redis_key, (num, expiry) in pending.items():
+                    pipe.incrby(redis_key, num)
+                    if expiry > 0:
+                        pipe.expire(redis_key, expiry, nx=True)
+                    if self.prepare is not None:
+                        self.prepare(pipe, redis_key)
+                pipe.execute()
+            except Exception as e:
+                self.__get_logger__("flush").error(e)
+                # 合并回缓冲区，期间新增的增量不受影响
+                with self._lock:
+                    self._backoff_until = time.monotonic() + self.flush_interval
+                    for redis_key, (num, expiry) in pending.items():
+                        item: Optional[List[int]] = self._pending.get(redis_key)
+                        if item is None:
+                            self._pending[redis_key] = [num, expiry]
+                        else:
+                            item[0] += num
+                        self._pending_total += abs(num)
+                return 0
+            self._backoff_until = 0
+            if self.flushed is not None:
+                self.flushed(list(pending))
+            return len(pending)
+
+    def close(self):
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,203 @@
+# -*- coding: UTF-8 -*-
+import time
+import uuid
+import threading
+from flask import Flask
+from typing import Optional, Any
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+from . import QuickCache
+from .ShardedRedis import ShardedRedis
+
+# 加锁成功时递增并返回栅栏令牌；失败时返回持有者剩余的毫秒数（取负数），等待不会超过这个时间
+LUA_ACQUIRE = """
+if redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return redis.call('INCR', KEYS[2])
+end
+return -math.max(redis.call('PTTL', KEYS[1]), 1)
+"""
+
+# 只有持有者才能释放，释放后通知等待者立即重试
+LUA_RELEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('PUBLISH', ARGV[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+LUA_RENEW = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LockTimeout(Exception):
+    pass
+
+
+class DistributedLock(object):
+    """
+    基于redis的分布式锁：SET NX PX加锁，持有者的随机令牌防止误删其他进程的锁。
+    每次加锁成功都会得到一个单调递增的栅栏令牌（fencing_token），写入外部存储时带上它，可以拒绝锁过期后迟到的旧持有者。
+    等待时订阅释放通知，锁一释放就立即重试，不需要轮询；auto_renew为True时在后台线程中按ttl的1/3续期。
+    """
+    name: str
+    ttl: float
+    timeout: Optional[float]
+    auto_renew: bool
+    quick_cache: QuickCache
+    lock_key: str
+    fence_key: str
+    channel: str
+    token: Optional[str]
+    fencing_token: Optional[int]
+    lost: bool
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, name: str, ttl: float = 30, timeout: Optional[float] = None, auto_renew: bool = False,
+            quick_cache: Optional[QuickCache] = None, current_app: Optional[Flask] = None
+    ):
+        if ttl <= 0:
+            raise ValueError("ttl必须大于0")
+        self.name = name
+        self.ttl = ttl
+        # with语句中等待加锁的最长时间，None表示一直等待
+        self.timeout = timeout
+        self.auto_renew = auto_renew
+        self.quick_cache = quick_cache if quick_cache is not None else QuickCache(current_app=current_app)
+        # 锁、栅栏计数器和通知频道使用同一个hash tag，分片时落在同一个节点上
+        self.lock_key = f"{self.quick_cache.redis_key}:Lock:{{{name}}}"
+        self.fence_key = f"{self.lock_key}:Fence"
+        self.channel = f"{self.lock_key}:Released"
+        self.token = None
+        self.fencing_token = None
+        self.lost = False
+        self._stop_renew: Optional[threading.Event] = None
+        self._renew_thread: Optional[threading.Thread] = None
+
+    def __try_acquire__(self, token: str) -> int:
+        script = self.quick_cache.__get_script__("lock_acquire", LUA_ACQUIRE)
+        return int(script(keys=[self.lock_key, self.fence_key], args=[token, int(self.ttl * 1000)]))
+
+    def __pubsub__(self) -> Any:
+        redis_db: Any = self.quick_cache.redis_db
+        if isinstance(redis_db, ShardedRedis):
+            redis_db = redis_db.get_client(self.channel)
+        return redis_db.pubsub(ignore_subscribe_messages=True)
+
+    def acquire(self, blocking: bool = True, timeout: Optional[float] = None) -> bool:
+        """
+        timeout为None时一直等待；redis不可用时返回False
+        """
+        if self.token is not None:
+            raise RuntimeError(f"锁[{self.name}]已经被当前对象持有")
+        token: str = uuid.uuid4().hex
+        deadline: Optional[float] = time.monotonic() + timeout if timeout is not None else None
+        pubsub: Any = None
+        try:
+            while True:
+                result: int = self.__try_acquire__(token)
+                if result > 0:
+                    self.token = token
+                    self.fencing_token = result
+                    self.lost = False
+                    if self.auto_renew:
+                        self.__start_renew__()
+                    return True
+                if not blocking:
+                    return False
+                wait: float = -result / 1000
+                if deadline is not None:
+                    remaining: float = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                if pubsub is None:
+                    # 先订阅再重试一次，避免在两次操作之间错过释放通知
+                    pubsub = self.__pubsub__()
+                    pubsub.subscribe(self.channel)
+                    continue
+                # 等到释放通知或持有者的锁过期为止
+                pubsub.get_message(timeout=wait)
+        except Exception as e:
+            self.__get_logger__("acquire").error(e)
+            return False
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception as e:
+                    self.__get_logger__("acquire").debug(e)
+
+    def release(self) -> bool:
+        """
+        返回是否由当前对象释放；锁已经过期或被其他进程持有时返回False
+        """
+        if self.token is None:
+            return False
+        self.__stop_renew__()
+        token: str = self.token
+        self.token = None
+        try:
+            script = self.quick_cache.__get_script__("lock_release", LUA_RELEASE)
+            return int(script(keys=[self.lock_key], args=[token, self.channel])) == 1
+        except Exception as e:
+            self.__get_logger__("release").error(e)
+            return False
+
+    def renew(self) -> bool:
+        """
+        把锁的过期时间重置为ttl，锁已经不属于当前对象时返回False
+        """
+        token: Optional[str] = self.token
+        if token is None:
+            return False
+        try:
+            script = self.quick_cache.__get_script__("lock_renew", LUA_RENEW)
+            return int(script(keys=[self.lock_key], args=[token, int(self.ttl * 1000)])) == 1
+        except Exception as e:
+            self.__get_logger__("renew").error(e)
+            return False
+
+    def locked(self) -> bool:
+        return self.token is not None and not self.lost
+
+    def __start_renew__(self):
+        stop: threading.Event = threading.Event()
+
+        def run():
+            console_log = self.__get_logger__("renew")
+            while not stop.wait(self.ttl / 3):
+                if not self.renew():
+                    # 续期失败说明锁已经过期并可能被其他进程持有，持有者需要检查lost
+                    self.lost = True
+                    console_log.warning(f"锁[{self.name}]续期失败，可能已经丢失")
+                    return
+
+        self._stop_renew = stop
+        self._renew_thread = threading.Thread(target=run, name=f"{self.__class__.__name__}:{self.name}", daemon=True)
+        self._renew_thread.start()
+
+    def __stop_renew__(self):
+        if self._stop_renew is None:
+            return
+        self._stop_renew.set()
+        if self._renew_thread is not None and self._renew_thread is not threading.current_thread():
+            self._renew_thread.join()
+        self._stop_renew = None
+        self._renew_thread = None
+
+    def __enter__(self) -> "DistributedLock":
+        if not self.acquire(timeout=self.timeout):
+            raise LockTimeout(f"无法获取锁[{self.name}]")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
@@ -1,5 +1,4 @@
 # -*- coding: UTF-8 -*-
-from typing import List
 from mio.sys import redis_db
 
 
@@ -16,8 +15,7 @@ class FlaskCachingHelper(object):
         if need_url_for:
             from flask import url_for
             function_name = url_for(function_name)
-        keys: List[bytes] = redis_db.keys(search_key)
-        for _key_ in keys:
+        for _key_ in redis_db.scan_iter(match=search_key, count=500):
             url_key: str = _key_.decode("UTF-8")
             if function_name in url_key:
                 redis_db.delete(url_key)
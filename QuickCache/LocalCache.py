@@ -0,0 +1,113 @@
+# -*- coding: UTF-8 -*-
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Dict, Any, List
+
+
+class LocalCache(object):
+    """
+    进程内的一级缓存，按条目数和字节数做LRU淘汰，每个条目都有独立的过期时间。
+    这里只保存redis中的原始字节，读取时再按调用方的格式解码，避免共享可变对象。
+    """
+    max_entries: int
+    max_bytes: int
+    ttl: float
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    enabled: bool = True
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._bytes: int = 0
+        # 正在从redis读取的键 -> [引用计数, 版本号]，读取期间被失效则版本号递增
+        self._pending: Dict[str, List[int]] = {}
+        self._lock = threading.Lock()
+
+    def __remove__(self, key: str):
+        # 调用方需要持有锁
+        item = self._items.pop(key, None)
+        if item is not None:
+            self._bytes -= len(item[1])
+
+    def get(self, key: str) -> Tuple[bool, Optional[bytes]]:
+        with self._lock:
+            item = self._items.get(key) if self.enabled else None
+            if item is None:
+                self.misses += 1
+                return False, None
+            expire_at, val = item
+            if expire_at <= time.monotonic():
+                self.__remove__(key)
+                self.misses += 1
+                return False, None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, val
+
+    def begin(self, key: str) -> int:
+        # 从redis读取之前登记，配合set的version参数丢弃读取期间已经失效的值
+        with self._lock:
+            pending: List[int] = self._pending.setdefault(key, [0, 0])
+            pending[0] += 1
+            return pending[1]
+
+    def release(self, key: str, version: Optional[int] = None) -> bool:
+        with self._lock:
+            return self.__release__(key, version)
+
+    def __release__(self, key: str, version: Optional[int]) -> bool:
+        # 调用方需要持有锁，返回值表示读取期间是否没有发生失效
+        pending: Optional[List[int]] = self._pending.get(key)
+        if pending is None:
+            return version is None
+        pending[0] -= 1
+        if pending[0] <= 0:
+            del self._pending[key]
+        return version is None or pending[1] == version
+
+    def set(self, key: str, val: bytes, ttl: Optional[float] = None, version: Optional[int] = None):
+        # ttl用于传入redis中剩余的过期时间，本地缓存的时长不会超过它
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        size: int = len(val)
+        with self._lock:
+            is_fresh: bool = self.__release__(key, version) if version is not None else True
+            self.__remove__(key)
+            if not self.enabled or not is_fresh or ttl <= 0 or size > self.max_bytes:
+                return
+            self._items[key] = (time.monotonic() + ttl, val)
+            self._bytes += size
+            while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, old_val) = self._items.popitem(last=False)
+                self._bytes -= len(old_val)
+                self.evictions += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self.__remove__(key)
+                if key in self._pending:
+                    self._pending[key][1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._bytes = 0
+            for pending in self._pending.values():
+                pending[1] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total: int = self.hits + self.misses
+            return {
+                "entries": len(self._items),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
@@ -0,0 +1,14 @@
+# -*- coding: UTF-8 -*-
+from typing import Optional, Dict
+from mio.util.Logs import LogHandler
+
+# 按名称缓存LogHandler，模块内所有类共用，避免每次调用都重新创建
+_loggers: Dict[str, LogHandler] = {}
+
+
+def get_logger(name: str) -> LogHandler:
+    logger: Optional[LogHandler] = _loggers.get(name)
+    if logger is None:
+        logger = LogHandler(name)
+        _loggers[name] = logger
+    return logger
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+import socket
+import threading
+from typing import Optional, Any, Tuple, List, Dict
+
+# 延迟直方图的分桶（秒）
+LATENCY_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class OperationStats(object):
+    calls: int = 0
+    hits: int = 0
+    misses: int = 0
+    errors: int = 0
+    bytes_in: int = 0
+    bytes_out: int = 0
+    latency_sum: float = 0.0
+
+    def __init__(self, bucket_size: int):
+        # 最后一个桶对应+Inf
+        self.buckets: List[int] = [0] * (bucket_size + 1)
+
+    def to_dict(self, buckets: Tuple[float, ...]) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latency_sum": self.latency_sum,
+            "latency_avg": self.latency_sum / self.calls if self.calls > 0 else 0.0,
+            "latency_buckets": dict(zip([str(b) for b in buckets] + ["+Inf"], self.buckets)),
+        }
+
+
+class Metrics(object):
+    """
+    按(操作, 键的命名空间)统计调用次数、命中、错误、流量和延迟直方图。
+    push型的sink（例如StatsdSink）在每次记录时同步收到数据，pull型的（例如Prometheus）通过snapshot/render读取。
+    """
+    buckets: Tuple[float, ...]
+    max_namespaces: int
+    sinks: List[Any]
+
+    def __init__(
+            self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, max_namespaces: int = 200,
+            sinks: Optional[List[Any]] = None
+    ):
+        self.buckets = buckets
+        self.max_namespaces = max_namespaces
+        self.sinks = sinks if sinks is not None else []
+        self._stats: Dict[Tuple[str, str], OperationStats] = {}
+        self._namespaces: Dict[str, None] = {}
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink: Any):
+        self.sinks.append(sink)
+
+    def record(
+            self, op: str, namespace: str, latency: float, hits: int = 0, misses: int = 0, error: bool = False,
+            bytes_in: int = 0, bytes_out: int = 0
+    ):
+        with self._lock:
+            # 限制命名空间的数量，避免键设计不当时指标无限膨胀
+            if namespace not in self._namespaces:
+                if len(self._namespaces) >= self.max_namespaces:
+                    namespace = "other"
+                self._namespaces[namespace] = None
+            stats: Optional[OperationStats] = self._stats.get((op, namespace))
+            if stats is None:
+                stats = OperationStats(len(self.buckets))
+                self._stats[(op, namespace)] = stats
+            stats.calls += 1
+            stats.hits += hits
+            stats.misses += misses
+            stats.errors += 1 if error else 0
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            stats.latency_sum += latency
+            index: int = len(self.buckets)
+            for i, bound in enumerate(self.buckets):
+                if latency <= bound:
+                    index = i
+                    break
+            stats.buckets[index] += 1
+        for sink in self.sinks:
+            try:
+                sink.record(op, namespace, latency, hits, misses, error, bytes_in, bytes_out)
+            except Exception:
+                pass
+
+    def snapshot(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """
+        返回 {操作: {命名空间: 统计数据}}
+        """
+        result: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        with self._lock:
+            for (op, namespace), stats in self._stats.items():
+                result.setdefault(op, {})[namespace] = stats.to_dict(self.buckets)
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+            self._namespaces.clear()
+
+
+class PrometheusSink(object):
+    """
+    输出Prometheus文本格式，通常挂在一个/metrics路由上
+    """
+    metrics: Metrics
+    prefix: str
+
+    def __init__(self, metrics: Metrics, prefix: str = "quick_cache"):
+        self.metrics = metrics
+        self.prefix = prefix
+
+    @staticmethod
+    def __escape__(value: str) -> str:
+        return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+    def record(self, *args):
+        # 拉取模式，不需要处理单次记录
+        pass
+
+    def render(self) -> str:
+        snapshot: Dict[str, Dict[str, Dict[str, Any]]] = self.metrics.snapshot()
+        counters: List[Tuple[str, str]] = [
+            ("calls", "operations_total"), ("hits", "hits_total"), ("misses", "misses_total"),
+            ("errors", "errors_total"), ("bytes_in", "bytes_in_total"), ("bytes_out", "bytes_out_total"),
+        ]
+        lines: List[str] = []
+        for field, name in counters:
+            lines.append(f"# TYPE {self.prefix}_{name} counter")
+            for op, namespaces in snapshot.items():
+                for namespace, stats in namespaces.items():
+                    labels: str = f'op="{self.__escape__(op)}",namespace="{self.__escape__(namespace)}"'
+                    lines.append(f"{self.prefix}_{name}{{{labels}}} {stats[field]}")
+        name = f"{self.prefix}_latency_seconds"
+        lines.append(f"# TYPE {name} histogram")
+        for op, namespaces in snapshot.items():
+            for namespace, stats in namespaces.items():
+                labels = f'op="{self.__escape__(op)}",namespace="{self.__escape__(namespace)}"'
+                cumulative: int = 0
+                for le, count in stats["latency_buckets"].items():
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {stats['latency_sum']}")
+                lines.append(f"{name}_count{{{labels}}} {stats['calls']}")
+        return "\n".join(lines) + "\n"
+
+
+class StatsdSink(object):
+    """
+    通过UDP推送到StatsD，发送失败直接忽略，不影响缓存操作本身
+    """
+    host: str
+    port: int
+    prefix: str
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8125, prefix: str = "quick_cache"):
+        self.host = host
+        self.port = port
+        self.prefix = prefix
+        # 只在创建时解析一次地址，推送时不再查询DNS
+        family, _, _, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_DGRAM)[0]
+        self._address: Tuple[Any, ...] = address
+        self._socket = socket.socket(family, socket.SOCK_DGRAM)
+        self._socket.setblocking(False)
+
+    def record(
+            self, op: str, namespace: str, latency: float, hits: int, misses: int, error: bool, bytes_in: int,
+            bytes_out: int
+    ):
+        name: str = f"{self.prefix}.{namespace.replace('.', '_')}.{op}"
+        lines: List[str] = [f"{name}.calls:1|c", f"{name}.latency:{latency * 1000:.3f}|ms"]
+        if hits > 0:
+            lines.append(f"{name}.hits:{hits}|c")
+        if misses > 0:
+            lines.append(f"{name}.misses:{misses}|c")
+        if error:
+            lines.append(f"{name}.errors:1|c")
+        if bytes_in > 0:
+            lines.append(f"{name}.bytes_in:{bytes_in}|c")
+        if bytes_out > 0:
+            lines.append(f"{name}.bytes_out:{bytes_out}|c")
+        try:
+            self._socket.sendto("\n".join(lines).encode("utf-8"), self._address)
+        except OSError:
+            pass
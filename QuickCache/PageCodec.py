@@ -0,0 +1,143 @@
+# -*- coding: UTF-8 -*-
+import gzip
+import struct
+import hashlib
+from typing import Optional, Tuple, List, Union
+from .ShardedRedis import hash_tag
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# 页面缓存的存储格式：
+#   MAGIC(4字节) + 压缩算法(1字节) + 分块数量(4字节，大端) + 数据
+# 分块数量为0时数据直接跟在头部后面；否则头部后面是数据的哈希（代数），数据保存在 {<key>}:Chunk:<代数>:<i> 中，
+# 读取时一次MGET取回。分块的键名包含代数，重写页面不会覆盖旧的分块，头部和分块总是对应同一份数据。
+MAGIC = b"\x00QCP"
+HEAD_SIZE = len(MAGIC) + 5
+COMPRESS_NONE = 0
+COMPRESS_GZIP = 1
+COMPRESS_ZSTD = 2
+COMPRESSORS = {None: COMPRESS_NONE, "gzip": COMPRESS_GZIP, "zstd": COMPRESS_ZSTD}
+
+# 删除被替换掉的分块；页面已经被重新写回同一代数据时不删除
+LUA_UNLINK_STALE_CHUNKS = """
+local head = redis.call('GET', KEYS[1])
+if head and string.sub(head, tonumber(ARGV[1]) + 1) == ARGV[2] then
+    return 0
+end
+return redis.call('UNLINK', unpack(KEYS, 2))
+"""
+
+
+def chunk_key(redis_key: str, index: int, generation: str) -> str:
+    # 分块的hash tag与页面的键保持一致，分片时与页面落在同一个节点上，可以在一个事务中写入
+    if hash_tag(redis_key) != redis_key:
+        return f"{redis_key}:Chunk:{generation}:{index}"
+    return f"{{{redis_key}}}:Chunk:{generation}:{index}"
+
+
+def chunk_keys(redis_key: str, head: Optional[bytes]) -> List[str]:
+    """
+    返回头部对应的所有分块的键，数据内联或者不是页面格式时返回空列表
+    """
+    if not head or not is_page(head):
+        return []
+    _, chunk_count, generation = parse_head(head)
+    if chunk_count <= 0:
+        return []
+    return [chunk_key(redis_key, index, generation.decode("ascii")) for index in range(chunk_count)]
+
+
+def stale_chunk_keys(redis_key: str, old_head: Optional[bytes], new_head: bytes) -> Tuple[str, List[str]]:
+    """
+    返回(旧的代数, 旧头部中不再被新头部使用的分块的键)
+    """
+    old_keys: List[str] = chunk_keys(redis_key, old_head)
+    if len(old_keys) <= 0:
+        return "", []
+    used = set(chunk_keys(redis_key, new_head))
+    return parse_head(old_head)[2].decode("ascii"), [_k for _k in old_keys if _k not in used]
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    按q值解析Accept-Encoding，gzip;q=0表示明确不接受
+    """
+    accepted: Optional[bool] = None
+    for item in accept_encoding.lower().split(","):
+        parts: List[str] = [part.strip() for part in item.split(";")]
+        quality: float = 1.0
+        for param in parts[1:]:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if parts[0] == "gzip":
+            return quality > 0
+        if parts[0] == "*":
+            accepted = quality > 0
+    return bool(accepted)
+
+
+def compress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESS_GZIP:
+        # mtime固定为0，同样的内容压缩结果一致
+        return gzip.compress(data, compresslevel=6, mtime=0)
+    if compression == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise ValueError("需要安装zstandard才能使用zstd压缩")
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress(data: bytes, compression: int) -> bytes:
+    if compression == COMPRESS_GZIP:
+        return gzip.decompress(data)
+    if compression == COMPRESS_ZSTD:
+        if zstandard is None:
+            raise ValueError("需要安装zstandard才能使用zstd压缩")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+
+def encode_page(
+        text: str, compressor: Optional[str] = "gzip", chunk_size: int = 512 * 1024
+) -> Tuple[bytes, List[bytes]]:
+    """
+    返回(头部, 分块列表)，分块列表为空时头部中已经包含全部数据
+    """
+    if compressor not in COMPRESSORS:
+        raise ValueError(f"不支持的页面压缩算法[{compressor}]")
+    compression: int = COMPRESSORS[compressor]
+    data: bytes = compress(text.encode("utf-8"), compression)
+    if chunk_size <= 0 or len(data) <= chunk_size:
+        return MAGIC + struct.pack(">BI", compression, 0) + data, []
+    chunks: List[bytes] = [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+    generation: bytes = hashlib.blake2b(data, digest_size=8).hexdigest().encode("ascii")
+    return MAGIC + struct.pack(">BI", compression, len(chunks)) + generation, chunks
+
+
+def is_page(head: bytes) -> bool:
+    return len(head) >= HEAD_SIZE and head[:len(MAGIC)] == MAGIC
+
+
+def parse_head(head: bytes) -> Tuple[int, int, bytes]:
+    """
+    返回(压缩算法, 分块数量, 内联数据)；有分块时第三项为分块的代数
+    """
+    compression, chunk_count = struct.unpack(">BI", head[len(MAGIC):HEAD_SIZE])
+    return compression, chunk_count, head[HEAD_SIZE:]
+
+
+def decode_page(compression: int, data: bytes, gzipped: bool = False) -> Union[str, bytes]:
+    """
+    gzipped为True时返回gzip压缩后的字节，存储格式本身就是gzip时直接返回，不需要解压再压缩
+    """
+    if gzipped:
+        if compression == COMPRESS_GZIP:
+            return data
+        return compress(decompress(data, compression), COMPRESS_GZIP)
+    return decompress(data, compression).decode("utf-8")
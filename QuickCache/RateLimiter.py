@@ -0,0 +1,158 @@
+# -*- coding: UTF-8 -*-
+import time
+import uuid
+import threading
+from flask import Flask
+from typing import Optional, Tuple, Dict
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+from . import QuickCache
+
+# 滑动日志：每次请求记录到ZSET中，先移除窗口外的记录再计数
+LUA_SLIDING_WINDOW = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+local count = redis.call('ZCARD', KEYS[1])
+if count + cost <= limit then
+    for i = 1, cost do
+        redis.call('ZADD', KEYS[1], now, ARGV[4] .. ':' .. i)
+    end
+    redis.call('PEXPIRE', KEYS[1], window)
+    return {1, limit - count - cost, 0}
+end
+local retry = window
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+if oldest[2] and cost <= limit then
+    retry = tonumber(oldest[2]) + window - now
+end
+return {0, limit - count, retry}
+"""
+
+# 令牌桶：按时间匀速补充令牌，桶的容量决定允许的突发量
+LUA_TOKEN_BUCKET = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local retry = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry = math.ceil((cost - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, math.floor(tokens), retry}
+"""
+
+
+class RateLimiter(object):
+    """
+    基于redis的限流器，每次检查只执行一次Lua脚本（EVALSHA）。
+    被拒绝的调用方会在本地记录解封时间和被拒绝的cost，解封之前cost不小于它的检查直接在进程内返回，不再访问redis。
+    """
+    SLIDING_WINDOW = "sliding_window"
+    TOKEN_BUCKET = "token_bucket"
+    MAX_BLOCKED = 100000
+    name: str
+    limit: int
+    window: float
+    algorithm: str
+    burst: int
+    fail_open: bool
+    quick_cache: QuickCache
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, name: str, limit: int, window: float, algorithm: str = SLIDING_WINDOW,
+            burst: Optional[int] = None, fail_open: bool = True, quick_cache: Optional[QuickCache] = None,
+            current_app: Optional[Flask] = None
+    ):
+        if algorithm not in (self.SLIDING_WINDOW, self.TOKEN_BUCKET):
+            raise ValueError(f"不支持的限流算法[{algorithm}]")
+        if limit <= 0 or window <= 0:
+            raise ValueError("limit和window必须大于0")
+        self.name = name
+        self.limit = limit
+        self.window = window
+        self.algorithm = algorithm
+        # 令牌桶的容量，默认与limit相同
+        self.burst = burst if burst is not None else limit
+        self.fail_open = fail_open
+        self.quick_cache = quick_cache if quick_cache is not None else QuickCache(current_app=current_app)
+        # identity -> (解封时间, 被拒绝的cost)
+        self._blocked: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def __redis_key__(self, identity: str) -> str:
+        return f"{self.quick_cache.redis_key}:RateLimit:{self.name}:{identity}"
+
+    def __blocked_for__(self, identity: str, cost: int) -> float:
+        with self._lock:
+            blocked: Optional[Tuple[float, int]] = self._blocked.get(identity)
+            if blocked is None:
+                return 0
+            remaining: float = blocked[0] - time.monotonic()
+            if remaining <= 0:
+                del self._blocked[identity]
+                return 0
+            # 更小的cost在redis中可能被放行，需要实际检查
+            return remaining if cost >= blocked[1] else 0
+
+    def __block__(self, identity: str, retry_after: float, cost: int):
+        now: float = time.monotonic()
+        with self._lock:
+            if len(self._blocked) >= self.MAX_BLOCKED:
+                # 清理已经解封的记录，避免无限增长
+                self._blocked = {k: v for k, v in self._blocked.items() if v[0] > now}
+            self._blocked[identity] = (now + retry_after, cost)
+
+    def hit(self, identity: str, cost: int = 1) -> Tuple[bool, float]:
+        """
+        返回是否放行以及需要等待的秒数
+        """
+        retry_after: float = self.__blocked_for__(identity, cost)
+        if retry_after > 0:
+            return False, retry_after
+        window_ms: int = int(self.window * 1000)
+        try:
+            if self.algorithm == self.SLIDING_WINDOW:
+                script = self.quick_cache.__get_script__("rate_limit_sliding_window", LUA_SLIDING_WINDOW)
+                allowed, _, retry_ms = script(
+                    keys=[self.__redis_key__(identity)], args=[self.limit, window_ms, cost, uuid.uuid4().hex])
+            else:
+                script = self.quick_cache.__get_script__("rate_limit_token_bucket", LUA_TOKEN_BUCKET)
+                allowed, _, retry_ms = script(
+                    keys=[self.__redis_key__(identity)], args=[self.burst, repr(self.limit / window_ms), cost])
+        except Exception as e:
+            # 每次检查都在请求路径上，只在出错时才获取logger
+            self.__get_logger__("hit").error(e)
+            return self.fail_open, 0
+        if int(allowed) == 1:
+            return True, 0
+        retry_after = int(retry_ms) / 1000
+        if retry_after > 0:
+            self.__block__(identity, retry_after, cost)
+        return False, retry_after
+
+    def reset(self, identity: str):
+        with self._lock:
+            self._blocked.pop(identity, None)
+        self.quick_cache.remove_cache(self.__redis_key__(identity), is_full_key=True)
@@ -0,0 +1,137 @@
+# -*- coding: UTF-8 -*-
+import zlib
+import pickle
+from typing import Optional, Any, Callable, Dict
+
+# 头部字节的格式为 0b101CCSSS：CC为压缩算法编号，SSS为序列化格式编号。
+# 旧版本直接写入的pickle数据以0x80开头，不会与头部冲突，迁移期间可以混合读取。
+HEADER_FLAG = 0xA0
+HEADER_MASK = 0xE0
+PICKLE_PROTOCOL = min(5, pickle.HIGHEST_PROTOCOL)
+# 负缓存的占位值，表示数据源中确认不存在；以0x00开头，不会与上面两种数据混淆
+NOT_FOUND = b"\x00QCN"
+
+
+class Codec(object):
+    name: str
+    code: int
+    encode: Callable[[Any], bytes]
+    decode: Callable[[bytes], Any]
+
+    def __init__(self, name: str, code: int, encode: Callable[[Any], bytes], decode: Callable[[bytes], Any]):
+        self.name = name
+        self.code = code
+        self.encode = encode
+        self.decode = decode
+
+
+_serializers: Dict[str, Codec] = {}
+_serializer_codes: Dict[int, Codec] = {}
+_compressors: Dict[str, Codec] = {}
+_compressor_codes: Dict[int, Codec] = {}
+
+
+def register_serializer(name: str, code: int, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]):
+    if code < 1 or code > 7:
+        raise ValueError(f"序列化格式编号[{code}]必须在1~7之间")
+    codec: Codec = Codec(name, code, dumps, loads)
+    _serializers[name] = codec
+    _serializer_codes[code] = codec
+
+
+def register_compressor(
+        name: str, code: int, compress: Callable[[bytes], bytes], decompress: Callable[[bytes], bytes]
+):
+    if code < 1 or code > 3:
+        raise ValueError(f"压缩算法编号[{code}]必须在1~3之间")
+    codec: Codec = Codec(name, code, compress, decompress)
+    _compressors[name] = codec
+    _compressor_codes[code] = codec
+
+
+register_serializer(
+    "pickle", 1, lambda value: pickle.dumps(value, protocol=PICKLE_PROTOCOL), pickle.loads)
+register_compressor("zlib", 1, zlib.compress, zlib.decompress)
+
+try:
+    import orjson
+
+    register_serializer("orjson", 2, orjson.dumps, orjson.loads)
+except ImportError:
+    pass
+
+try:
+    import msgpack
+
+    register_serializer(
+        "msgpack", 3, lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False))
+except ImportError:
+    pass
+
+try:
+    import zstandard
+
+    register_compressor(
+        "zstd", 2, lambda data: zstandard.ZstdCompressor().compress(data),
+        lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+
+    register_compressor("lz4", 3, lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+    pass
+
+
+class Serializer(object):
+    """
+    serializer为None时保持旧版本的行为，直接写入不带头部的pickle数据，方便新旧版本同时在线。
+    读取时总是按头部字节自动识别格式，因此切换格式不需要清空缓存。
+    """
+    serializer: Optional[Codec]
+    compressor: Optional[Codec]
+    compress_threshold: int
+
+    def __init__(
+            self, serializer: Optional[str] = None, compressor: Optional[str] = None, compress_threshold: int = 1024
+    ):
+        if serializer is not None and serializer not in _serializers:
+            raise ValueError(f"序列化格式[{serializer}]不存在或对应的依赖未安装")
+        if compressor is not None and compressor not in _compressors:
+            raise ValueError(f"压缩算法[{compressor}]不存在或对应的依赖未安装")
+        if compressor is not None and serializer is None:
+            serializer = "pickle"
+        self.serializer = _serializers[serializer] if serializer is not None else None
+        self.compressor = _compressors[compressor] if compressor is not None else None
+        self.compress_threshold = compress_threshold
+
+    def dumps(self, value: Any) -> bytes:
+        if self.serializer is None:
+            return pickle.dumps(value)
+        data: bytes = self.serializer.encode(value)
+        compressor_code: int = 0
+        if self.compressor is not None and len(data) >= self.compress_threshold:
+            data = self.compressor.encode(data)
+            compressor_code = self.compressor.code
+        return bytes((HEADER_FLAG | (compressor_code << 3) | self.serializer.code,)) + data
+
+    @staticmethod
+    def loads(data: bytes) -> Any:
+        header: int = data[0]
+        if header & HEADER_MASK != HEADER_FLAG:
+            # 旧版本的pickle数据
+            return pickle.loads(data)
+        serializer: Optional[Codec] = _serializer_codes.get(header & 0x07)
+        if serializer is None:
+            raise ValueError(f"无法识别的序列化格式[{header & 0x07}]")
+        payload: bytes = data[1:]
+        compressor_code: int = (header >> 3) & 0x03
+        if compressor_code > 0:
+            compressor: Optional[Codec] = _compressor_codes.get(compressor_code)
+            if compressor is None:
+                raise ValueError(f"无法识别的压缩算法[{compressor_code}]")
+            payload = compressor.decode(payload)
+        return serializer.decode(payload)
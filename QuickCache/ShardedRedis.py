@@ -0,0 +1,282 @@
+# -*- coding: UTF-8 -*-
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, Tuple, List, Dict, Callable, Iterator
+
+
+def hash_tag(key: Any) -> str:
+    """
+    与redis cluster相同的hash tag规则：键中第一对非空的{}内的内容决定分片，用于让相关的键落在同一个节点上
+    """
+    key = str(key, encoding="utf-8") if isinstance(key, bytes) else str(key)
+    start: int = key.find("{")
+    if start >= 0:
+        end: int = key.find("}", start + 1)
+        if end > start + 1:
+            return key[start + 1:end]
+    return key
+
+
+def command_key(name: str, args: tuple) -> Any:
+    """
+    返回命令中用于路由的键：EVAL/EVALSHA是第一个KEYS，BITOP是目标键，其余命令是第一个参数
+    """
+    if name in ("eval", "evalsha"):
+        return args[2]
+    if name == "bitop":
+        return args[1]
+    return args[0]
+
+
+class HashRing(object):
+    """
+    带虚拟节点的一致性哈希环，增删节点时只有约1/N的键需要迁移到其他节点
+    """
+    vnodes: int
+
+    def __init__(self, nodes: Optional[List[str]] = None, vnodes: int = 160):
+        self.vnodes = vnodes
+        self._nodes: List[str] = []
+        self._points: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes or []:
+            self.add_node(node)
+
+    @staticmethod
+    def __hash_value__(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode("utf-8")).digest()[:8], "big")
+
+    def __rebuild__(self):
+        ring: List[Tuple[int, str]] = sorted(
+            (self.__hash_value__(f"{node}#{i}"), node) for node in self._nodes for i in range(self.vnodes))
+        self._points = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+
+    @property
+    def nodes(self) -> List[str]:
+        return list(self._nodes)
+
+    def add_node(self, node: str):
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        self.__rebuild__()
+
+    def remove_node(self, node: str):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        self.__rebuild__()
+
+    def get_node(self, key: Any) -> str:
+        if len(self._points) <= 0:
+            raise ValueError("哈希环中没有任何节点")
+        index: int = bisect.bisect_right(self._points, self.__hash_value__(hash_tag(key)))
+        return self._owners[index % len(self._owners)]
+
+
+class ShardedScript(object):
+    """
+    按第一个键路由的Lua脚本，多键脚本需要使用hash tag保证所有键在同一个节点上
+    """
+
+    def __init__(self, sharded: "ShardedRedis", script: str):
+        self.sharded = sharded
+        self.script = script
+        self._scripts: Dict[str, Any] = {}
+
+    def __call__(self, keys: Optional[List[Any]] = None, args: Optional[List[Any]] = None, client: Any = None):
+        node: str = self.sharded.get_node(keys[0]) if keys else self.sharded.ring.nodes[0]
+        if node not in self._scripts:
+            self._scripts[node] = self.sharded.nodes[node].register_script(self.script)
+        return self._scripts[node](keys=keys, args=args)
+
+
+class ShardedPipeline(object):
+    """
+    按节点拆分的pipeline：每个节点一个pipeline并行执行，结果按原来的顺序返回。
+    transaction只对同一个节点上的命令生效。
+    """
+
+    def __init__(self, sharded: "ShardedRedis", transaction: bool = True):
+        self.sharded = sharded
+        self.transaction = transaction
+        self._commands: Dict[str, List[Tuple[str, tuple, dict]]] = {}
+        self._slots: List[Tuple[str, Any]] = []
+
+    def __queue__(self, node: str, method: str, args: tuple, kwargs: dict) -> Tuple[str, int]:
+        commands: List[Tuple[str, tuple, dict]] = self._commands.setdefault(node, [])
+        commands.append((method, args, kwargs))
+        return node, len(commands) - 1
+
+    def __getattr__(self, name: str) -> Callable[..., "ShardedPipeline"]:
+        def command(*args, **kwargs) -> "ShardedPipeline":
+            node: str = self.sharded.get_node(command_key(name, args))
+            self._slots.append(("single", self.__queue__(node, name, args, kwargs)))
+            return self
+
+        return command
+
+    def mget(self, keys: Any, *args) -> "ShardedPipeline":
+        keys = [keys] + list(args) if isinstance(keys, (str, bytes)) else list(keys) + list(args)
+        parts: List[Tuple[Tuple[str, int], List[int]]] = []
+        for node, positions in self.sharded.group_keys(keys).items():
+            parts.append((self.__queue__(node, "mget", ([keys[i] for i in positions],), {}), positions))
+        self._slots.append(("mget", (parts, len(keys))))
+        return self
+
+    def execute(self) -> List[Any]:
+        def run(node: str) -> List[Any]:
+            pipe = self.sharded.nodes[node].pipeline(transaction=self.transaction)
+            for method, args, kwargs in self._commands[node]:
+                getattr(pipe, method)(*args, **kwargs)
+            return pipe.execute()
+
+        try:
+            nodes: List[str] = list(self._commands)
+            results: Dict[str, List[Any]] = dict(zip(nodes, self.sharded.map(run, nodes)))
+            output: List[Any] = []
+            for kind, slot in self._slots:
+                if kind == "single":
+                    node, position = slot
+                    output.append(results[node][position])
+                    continue
+                parts, size = slot
+                merged: List[Any] = [None] * size
+                for (node, position), positions in parts:
+                    for index, value in zip(positions, results[node][position]):
+                        merged[index] = value
+                output.append(merged)
+            return output
+        finally:
+            self.reset()
+
+    def reset(self):
+        self._commands = {}
+        self._slots = []
+
+
+class ShardedRedis(object):
+    """
+    通过一致性哈希把键分散到多个redis节点上，对外提供与redis-py客户端相同的常用接口：
+    单键命令按键路由，mget、delete、unlink以及pipeline按节点拆分后并行执行，scan依次遍历所有节点。
+    """
+    ring: HashRing
+    nodes: Dict[str, Any]
+    max_workers: Optional[int]
+
+    def __init__(self, nodes: Dict[str, Any], vnodes: int = 160, max_workers: Optional[int] = None):
+        self.nodes = dict(nodes)
+        self.ring = HashRing(sorted(self.nodes), vnodes=vnodes)
+        # 所有线程共用的并行执行线程数，默认每个节点4个
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(
+            cls, urls: List[str], vnodes: int = 160, max_workers: Optional[int] = None, **kwargs
+    ) -> "ShardedRedis":
+        from redis import Redis
+        return cls({url: Redis.from_url(url, **kwargs) for url in urls}, vnodes=vnodes, max_workers=max_workers)
+
+    def add_node(self, name: str, client: Any):
+        with self._lock:
+            self.nodes[name] = client
+            self.ring.add_node(name)
+            self.__reset_executor__()
+
+    def remove_node(self, name: str):
+        with self._lock:
+            self.ring.remove_node(name)
+            self.nodes.pop(name, None)
+            self.__reset_executor__()
+
+    def __reset_executor__(self):
+        # 调用方需要持有锁；任务都是在锁内提交的，旧的执行器不会再收到新任务，已提交的任务仍会执行完
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def map(self, fn: Callable[[Any], Any], items: List[Any]) -> List[Any]:
+        # 只有一个节点时直接执行，省去线程切换的开销
+        if len(items) <= 1:
+            return [fn(item) for item in items]
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers or max(len(self.nodes), 1) * 4,
+                    thread_name_prefix=self.__class__.__name__)
+            futures: List[Any] = [self._executor.submit(fn, item) for item in items[1:]]
+        # 第一个节点由调用线程自己执行，线程池被其他线程占满时也总能推进
+        first: Any = fn(items[0])
+        return [first] + [future.result() for future in futures]
+
+    def get_node(self, key: Any) -> str:
+        return self.ring.get_node(key)
+
+    def get_client(self, key: Any) -> Any:
+        return self.nodes[self.get_node(key)]
+
+    def group_keys(self, keys: List[Any]) -> Dict[str, List[int]]:
+        groups: Dict[str, List[int]] = {}
+        for index, key in enumerate(keys):
+            groups.setdefault(self.get_node(key), []).append(index)
+        return groups
+
+    def __getattr__(self, name: str) -> Callable[..., Any]:
+        # 其余命令都按键路由，多键命令需要使用hash tag保证所有键在同一个节点上
+        def command(*args, **kwargs) -> Any:
+            return getattr(self.get_client(command_key(name, args)), name)(*args, **kwargs)
+
+        return command
+
+    def __fan_out__(self, method: str, keys: List[Any]) -> int:
+        groups: Dict[str, List[int]] = self.group_keys(keys)
+        return sum(self.map(
+            lambda node: getattr(self.nodes[node], method)(*[keys[i] for i in groups[node]]), list(groups)))
+
+    def delete(self, *keys: Any) -> int:
+        return self.__fan_out__("delete", list(keys))
+
+    def unlink(self, *keys: Any) -> int:
+        return self.__fan_out__("unlink", list(keys))
+
+    def exists(self, *keys: Any) -> int:
+        return self.__fan_out__("exists", list(keys))
+
+    def mget(self, keys: Any, *args) -> List[Optional[bytes]]:
+        keys = [keys] + list(args) if isinstance(keys, (str, bytes)) else list(keys) + list(args)
+        groups: Dict[str, List[int]] = self.group_keys(keys)
+        nodes: List[str] = list(groups)
+        values: List[List[Optional[bytes]]] = self.map(
+            lambda node: self.nodes[node].mget([keys[i] for i in groups[node]]), nodes)
+        result: List[Optional[bytes]] = [None] * len(keys)
+        for node, node_values in zip(nodes, values):
+            for index, value in zip(groups[node], node_values):
+                result[index] = value
+        return result
+
+    def pipeline(self, transaction: bool = True, shard_hint: Any = None) -> ShardedPipeline:
+        return ShardedPipeline(self, transaction=transaction)
+
+    def register_script(self, script: str) -> ShardedScript:
+        return ShardedScript(self, script)
+
+    def scan(self, cursor: int = 0, match: Any = None, count: Optional[int] = None, **kwargs) -> Tuple[int, List]:
+        # 游标中同时编码了节点序号：cursor = 节点内游标 * 节点数 + 节点序号
+        names: List[str] = self.ring.nodes
+        size: int = len(names)
+        index: int = cursor % size
+        inner, keys = self.nodes[names[index]].scan(cursor=cursor // size, match=match, count=count, **kwargs)
+        if int(inner) == 0:
+            index += 1
+            if index >= size:
+                return 0, keys
+        return int(inner) * size + index, keys
+
+    def scan_iter(self, match: Any = None, count: Optional[int] = None, **kwargs) -> Iterator[Any]:
+        for name in self.ring.nodes:
+            yield from self.nodes[name].scan_iter(match=match, count=count, **kwargs)
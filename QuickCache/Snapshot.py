@@ -0,0 +1,202 @@
+# -*- coding: UTF-8 -*-
+import gzip
+import json
+import time
+import struct
+import inspect
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from typing import Optional, Any, Tuple, List, Dict, Iterator, BinaryIO
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+from . import QuickCache
+
+# 快照文件为gzip压缩的二进制流：
+#   MAGIC(4字节) + 导出时间（毫秒，8字节）
+#   之后每条记录：键长度(2字节) + 键 + 剩余毫秒数(8字节，0表示没有过期时间) + 数据长度(4字节) + DUMP的结果
+MAGIC = b"QCS1"
+RECORD_HEAD = struct.Struct(">q I")
+
+
+class Snapshot(object):
+    """
+    通过DUMP/RESTORE导出和导入缓存，用于redis故障切换或清空之后预热，避免冷启动时所有请求都穿透到后端。
+    DUMP的格式与redis版本相关，只能导入到相同或更高版本的redis中。
+    """
+    quick_cache: QuickCache
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(self, quick_cache: Optional[QuickCache] = None, current_app: Optional[Flask] = None):
+        self.quick_cache = quick_cache if quick_cache is not None else QuickCache(current_app=current_app)
+
+    def default_patterns(self) -> List[str]:
+        prefix: str = self.quick_cache.redis_key
+        # 大页面的分块以hash tag开头：{prefix:Page:Cache:key}:Chunk:<代数>:i
+        return [f"{prefix}:Cache:*", f"{prefix}:Page:Cache:*", f"{{{prefix}:Page:Cache:*"]
+
+    def __dump_batch__(self, keys: List[str]) -> List[Tuple[str, int, bytes]]:
+        pipe = self.quick_cache.redis_db.pipeline(transaction=False)
+        for _k in keys:
+            pipe.pttl(_k)
+            pipe.dump(_k)
+        values: List[Any] = pipe.execute()
+        records: List[Tuple[str, int, bytes]] = []
+        for index, _k in enumerate(keys):
+            pttl, data = values[index * 2], values[index * 2 + 1]
+            # 导出过程中过期或被删除的键直接跳过
+            if data is None or pttl == -2:
+                continue
+            records.append((_k, max(int(pttl), 0), data))
+        return records
+
+    def export(self, filename: str, patterns: Optional[List[str]] = None, batch_size: int = 500) -> int:
+        """
+        导出匹配patterns的所有键及其剩余过期时间，默认导出普通缓存和页面缓存，返回导出的键数量
+        """
+        patterns = patterns if patterns is not None else self.default_patterns()
+        count: int = 0
+        with gzip.open(filename, "wb") as f:
+            f.write(MAGIC + struct.pack(">q", int(time.time() * 1000)))
+            for pattern in patterns:
+                batch: List[str] = []
+                for _k in self.quick_cache.scan_keys(pattern, count=batch_size, is_full_key=True):
+                    batch.append(_k)
+                    if len(batch) >= batch_size:
+                        count += self.__write_records__(f, self.__dump_batch__(batch))
+                        batch = []
+                if len(batch) > 0:
+                    count += self.__write_records__(f, self.__dump_batch__(batch))
+        return count
+
+    @staticmethod
+    def __write_records__(f: BinaryIO, records: List[Tuple[str, int, bytes]]) -> int:
+        for _k, pttl, data in records:
+            key: bytes = _k.encode("utf-8")
+            f.write(struct.pack(">H", len(key)) + key + RECORD_HEAD.pack(pttl, len(data)) + data)
+        return len(records)
+
+    @staticmethod
+    def __read_records__(f: BinaryIO) -> Iterator[Tuple[str, int, bytes]]:
+        while True:
+            head: bytes = f.read(2)
+            if len(head) < 2:
+                return
+            key: bytes = f.read(struct.unpack(">H", head)[0])
+            pttl, size = RECORD_HEAD.unpack(f.read(RECORD_HEAD.size))
+            yield str(key, encoding="utf-8"), pttl, f.read(size)
+
+    def __restore_batch__(self, records: List[Tuple[str, int, bytes]], exported_at: int, replace: bool) -> int:
+        now: int = int(time.time() * 1000)
+        pipe = self.quick_cache.redis_db.pipeline(transaction=False)
+        count: int = 0
+        for _k, pttl, data in records:
+            if pttl > 0:
+                # 按导出时的绝对过期时间恢复，导入之前已经过期的键不再写入
+                expire_at: int = exported_at + pttl
+                if expire_at <= now:
+                    continue
+                pipe.restore(_k, expire_at, data, replace=replace, absttl=True)
+            else:
+                pipe.restore(_k, 0, data, replace=replace)
+            # 布隆过滤器已经就绪时，导入的键也需要登记，否则会被判断为不存在
+            self.quick_cache.__bloom_add__(_k, pipe=pipe)
+            count += 1
+        if count > 0:
+            pipe.execute()
+            if self.quick_cache.local_cache is not None:
+                self.quick_cache.local_cache.delete(*[record[0] for record in records])
+        return count
+
+    def restore(self, filename: str, batch_size: int = 500, workers: int = 4, replace: bool = True) -> int:
+        """
+        并行地按批导入快照，返回写入的键数量；replace为False时已存在的键会导致该批次失败
+        """
+        console_log = self.__get_logger__(inspect.stack()[0].function)
+        count: int = 0
+        with gzip.open(filename, "rb") as f:
+            head: bytes = f.read(len(MAGIC) + 8)
+            if head[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"[{filename}]不是有效的缓存快照")
+            exported_at: int = struct.unpack(">q", head[len(MAGIC):])[0]
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=self.__class__.__name__) as executor:
+                futures: List[Any] = []
+                batch: List[Tuple[str, int, bytes]] = []
+                for record in self.__read_records__(f):
+                    batch.append(record)
+                    if len(batch) >= batch_size:
+                        futures.append(executor.submit(self.__restore_batch__, batch, exported_at, replace))
+                        batch = []
+                    if len(futures) >= workers * 2:
+                        # 控制未完成的批次数量，避免整个文件都读进内存
+                        count += self.__collect__(futures.pop(0), console_log)
+                if len(batch) > 0:
+                    futures.append(executor.submit(self.__restore_batch__, batch, exported_at, replace))
+                for future in futures:
+                    count += self.__collect__(future, console_log)
+        return count
+
+    @staticmethod
+    def __collect__(future: Any, console_log: LogHandler) -> int:
+        try:
+            return future.result()
+        except Exception as e:
+            console_log.error(e)
+            return 0
+
+    def warm_pages(self, pages: List[Dict[str, Any]]) -> int:
+        """
+        在服务接入流量之前预先渲染页面，pages中的每一项为
+        {"key": 缓存键, "template": 模板文件名, "expiry": 过期秒数（可选）, "context": 模板变量（可选）}，需要在app上下文中调用
+        """
+        console_log = self.__get_logger__(inspect.stack()[0].function)
+        self.quick_cache.warm_templates()
+        count: int = 0
+        for page in pages:
+            try:
+                text: Optional[str] = self.quick_cache.cache_page(
+                    page["key"], page["template"], page.get("expiry", 3600), **page.get("context", {}))
+                if text is not None:
+                    count += 1
+            except Exception as e:
+                console_log.error(f"{page.get('key')}: {e}")
+        return count
+
+
+def register_cli(app: Flask):
+    """
+    注册flask命令：flask quick-cache export/restore/warm <文件名>
+    """
+    import click
+    from flask.cli import AppGroup
+    group: AppGroup = AppGroup("quick-cache", help="QuickCache快照的导出和导入")
+
+    @group.command("export")
+    @click.argument("filename")
+    @click.option("--pattern", "patterns", multiple=True, help="要导出的键的匹配模式，可以指定多次")
+    @click.option("--batch-size", default=500, show_default=True)
+    def export_command(filename: str, patterns: Tuple[str, ...], batch_size: int):
+        count: int = Snapshot(current_app=app).export(filename, list(patterns) or None, batch_size=batch_size)
+        click.echo(f"导出了{count}个键")
+
+    @group.command("restore")
+    @click.argument("filename")
+    @click.option("--batch-size", default=500, show_default=True)
+    @click.option("--workers", default=4, show_default=True)
+    @click.option("--no-replace", is_flag=True, help="不覆盖已存在的键")
+    def restore_command(filename: str, batch_size: int, workers: int, no_replace: bool):
+        count: int = Snapshot(current_app=app).restore(
+            filename, batch_size=batch_size, workers=workers, replace=not no_replace)
+        click.echo(f"导入了{count}个键")
+
+    @group.command("warm")
+    @click.argument("filename")
+    def warm_command(filename: str):
+        # 文件内容为warm_pages所需的页面列表（json）
+        with open(filename, "r", encoding="utf-8") as f:
+            pages: List[Dict[str, Any]] = json.load(f)
+        count: int = Snapshot(current_app=app).warm_pages(pages)
+        click.echo(f"预先渲染了{count}个页面")
+
+    app.cli.add_command(group)
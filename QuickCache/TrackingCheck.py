@@ -0,0 +1,88 @@
+# -*- coding: UTF-8 -*-
+import os
+import sys
+import json
+import time
+import argparse
+from flask import Flask
+from typing import Optional, Any, List, Dict, Callable
+from . import QuickCache, _trackers
+from .Benchmark import start_redis_server
+
+# 用法：python -m plugins.QuickCache.TrackingCheck
+# 启动一个临时的redis-server，开启一级缓存和CLIENT TRACKING，用另一个客户端（相当于其他进程）改写键，
+# 检查本进程的一级缓存是否在超时之前失效；全部通过时返回0
+
+
+def wait_until(predicate: Callable[[], bool], timeout: float, interval: float = 0.01) -> Optional[float]:
+    """
+    返回条件成立所用的秒数，超时返回None
+    """
+    start: float = time.monotonic()
+    while time.monotonic() - start < timeout:
+        if predicate():
+            return time.monotonic() - start
+        time.sleep(interval)
+    return None
+
+
+def run(quick_cache: QuickCache, other: Any, timeout: float = 2.0) -> List[Dict[str, Any]]:
+    local_cache: Any = quick_cache.local_cache
+    results: List[Dict[str, Any]] = []
+
+    def check(name: str, redis_key: str, write: Callable[[], Any], read: Callable[[], Any], expected: Any):
+        read()
+        cached: bool = local_cache.get(redis_key)[0]
+        write()
+        elapsed: Optional[float] = wait_until(lambda: not local_cache.get(redis_key)[0], timeout)
+        value: Any = read()
+        results.append({
+            "name": name,
+            "cached_before_write": cached,
+            "evicted": elapsed is not None,
+            "eviction_ms": elapsed * 1000 if elapsed is not None else None,
+            "value_after_write": value,
+            "passed": cached and elapsed is not None and value == expected,
+        })
+
+    cache_key: str = f"{quick_cache.redis_key}:Cache:Tracking:Value"
+    quick_cache.cache(cache_key, "old", is_full_key=True)
+    check(
+        "cache", cache_key, lambda: other.set(cache_key, quick_cache.serializer.dumps("new")),
+        lambda: quick_cache.cache(cache_key, is_full_key=True)[1], "new")
+    namespace_key: str = f"{quick_cache.redis_key}:Namespace:Tracking"
+    # 一级缓存不保存未命中的结果，版本号需要先存在才能被缓存
+    other.set(namespace_key, 0)
+    check(
+        "namespace_version", namespace_key, lambda: other.incr(namespace_key),
+        lambda: quick_cache.namespace_version("Tracking"), 1)
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="检查CLIENT TRACKING能否让一级缓存跨客户端失效")
+    parser.add_argument("--redis-server", default="redis-server", help="redis-server可执行文件的路径")
+    parser.add_argument("--timeout", type=float, default=2.0, help="等待失效通知的最长秒数")
+    args = parser.parse_args(argv)
+    from redis import Redis
+    process, port = start_redis_server(args.redis_server)
+    try:
+        app: Flask = Flask(__name__)
+        app.config.update(
+            REDIS_KEY_PREFIX=f"QuickCacheTracking{os.getpid()}", QUICK_CACHE_L1_MAX_ENTRIES=1000,
+            QUICK_CACHE_L1_TRACKING=True, QUICK_CACHE_COUNTER_FLUSH_ON_EXIT=False)
+        quick_cache: QuickCache = QuickCache(current_app=app, redis_client=Redis(host="127.0.0.1", port=port))
+        tracker: Any = _trackers[quick_cache.registry_key]
+        if wait_until(lambda: tracker.is_active, args.timeout) is None:
+            raise RuntimeError("CLIENT TRACKING没有在超时之前建立")
+        results: List[Dict[str, Any]] = run(quick_cache, Redis(host="127.0.0.1", port=port), args.timeout)
+        tracker.stop()
+    finally:
+        process.terminate()
+        process.wait()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+    return 0 if all(result["passed"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
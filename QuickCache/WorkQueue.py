@@ -0,0 +1,201 @@
+# -*- coding: UTF-8 -*-
+import time
+import uuid
+from flask import Flask
+from typing import Optional, Any, Tuple, List
+from mio.util.Logs import LogHandler
+from .Logger import get_logger
+from . import QuickCache
+
+# 批量取出：从队列右侧弹出最多N个元素，原子地放入处理中列表并记录可见性超时
+LUA_MOVE_BATCH = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('RPOP', KEYS[1])
+    if not item then
+        break
+    end
+    redis.call('LPUSH', KEYS[2], item)
+    redis.call('ZADD', KEYS[3], ARGV[2], item)
+    items[#items + 1] = item
+end
+return items
+"""
+
+# 退回：从处理中列表移除后放回队列右侧，下一个被取出
+LUA_REQUEUE = """
+local removed = redis.call('LREM', KEYS[2], 1, ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+if removed > 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return removed
+"""
+
+# 回收超时任务；取出后还没来得及登记超时时间就崩溃的任务，从现在开始计算超时
+LUA_REQUEUE_EXPIRED = """
+local now = tonumber(ARGV[1])
+local processing = redis.call('LRANGE', KEYS[2], 0, -1)
+for _, item in ipairs(processing) do
+    redis.call('ZADD', KEYS[3], 'NX', now + tonumber(ARGV[2]), item)
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now, 'LIMIT', 0, tonumber(ARGV[3]))
+local count = 0
+for _, item in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], item)
+    if redis.call('LREM', KEYS[2], 1, item) > 0 then
+        redis.call('RPUSH', KEYS[1], item)
+        count = count + 1
+    end
+end
+return count
+"""
+
+
+class WorkQueue(object):
+    """
+    基于redis列表的可靠队列：生产者LPUSH，消费者通过BLMOVE阻塞取出并同时放入处理中列表。
+    处理完成后需要调用ack确认；超过可见性超时仍未确认的任务会被requeue_expired放回队列重新消费。
+    get返回的handle是任务在redis中的原始数据，用于ack/nack。
+    """
+    name: str
+    visibility_timeout: float
+    quick_cache: QuickCache
+    queue_key: str
+    processing_key: str
+    deadline_key: str
+    dead_key: str
+
+    def __get_logger__(self, name: str) -> LogHandler:
+        return get_logger(f"{self.__class__.__name__}.{name}")
+
+    def __init__(
+            self, name: str, visibility_timeout: float = 30, quick_cache: Optional[QuickCache] = None,
+            current_app: Optional[Flask] = None
+    ):
+        self.name = name
+        self.visibility_timeout = visibility_timeout
+        self.quick_cache = quick_cache if quick_cache is not None else QuickCache(current_app=current_app)
+        # 使用hash tag让队列相关的几个键落在同一个分片上，多键的Lua脚本和BLMOVE才能执行
+        self.queue_key = f"{self.quick_cache.redis_key}:Queue:{{{name}}}"
+        self.processing_key = f"{self.queue_key}:Processing"
+        self.deadline_key = f"{self.queue_key}:Deadline"
+        self.dead_key = f"{self.queue_key}:Dead"
+
+    def __dumps__(self, item: Any) -> bytes:
+        # 附带唯一id，保证相同内容的任务在处理中列表里也能区分开
+        return self.quick_cache.serializer.dumps((uuid.uuid4().hex, item))
+
+    def __loads__(self, handle: bytes) -> Any:
+        _, item = self.quick_cache.serializer.loads(handle)
+        return item
+
+    def __deadline__(self) -> int:
+        return int((time.time() + self.visibility_timeout) * 1000)
+
+    def __decode_jobs__(self, handles: List[bytes]) -> List[Tuple[bytes, Any]]:
+        jobs: List[Tuple[bytes, Any]] = []
+        for handle in handles:
+            try:
+                jobs.append((handle, self.__loads__(handle)))
+            except Exception as e:
+                # 无法解码的任务转入死信列表，避免被反复投递
+                self.__get_logger__("__decode_jobs__").error(e)
+                pipe = self.quick_cache.redis_db.pipeline(transaction=True)
+                pipe.lrem(self.processing_key, 1, handle)
+                pipe.zrem(self.deadline_key, handle)
+                pipe.lpush(self.dead_key, handle)
+                pipe.execute()
+        return jobs
+
+    def put(self, item: Any) -> bool:
+        return self.put_many([item]) == 1
+
+    def put_many(self, items: List[Any]) -> int:
+        if items is None or len(items) <= 0:
+            return 0
+        try:
+            self.quick_cache.redis_db.lpush(self.queue_key, *[self.__dumps__(item) for item in items])
+            return len(items)
+        except Exception as e:
+            self.__get_logger__("put_many").error(e)
+            return 0
+
+    def get(self, timeout: float = 0) -> Optional[Tuple[bytes, Any]]:
+        """
+        阻塞等待一个任务，timeout为0表示一直等待；返回(handle, item)，超时返回None
+        """
+        try:
+            handle: Optional[bytes] = self.quick_cache.redis_db.blmove(
+                self.queue_key, self.processing_key, timeout, src="RIGHT", dest="LEFT")
+            if handle is None:
+                return None
+            self.quick_cache.redis_db.zadd(self.deadline_key, {handle: self.__deadline__()})
+        except Exception as e:
+            self.__get_logger__("get").error(e)
+            return None
+        jobs: List[Tuple[bytes, Any]] = self.__decode_jobs__([handle])
+        return jobs[0] if len(jobs) > 0 else None
+
+    def get_many(self, count: int) -> List[Tuple[bytes, Any]]:
+        """
+        非阻塞地一次取出最多count个任务，只需要一次往返
+        """
+        if count <= 0:
+            return []
+        try:
+            script = self.quick_cache.__get_script__("queue_move_batch", LUA_MOVE_BATCH)
+            handles: List[bytes] = script(
+                keys=[self.queue_key, self.processing_key, self.deadline_key], args=[count, self.__deadline__()])
+        except Exception as e:
+            self.__get_logger__("get_many").error(e)
+            return []
+        return self.__decode_jobs__(handles)
+
+    def ack(self, *handles: bytes) -> int:
+        if len(handles) <= 0:
+            return 0
+        try:
+            pipe = self.quick_cache.redis_db.pipeline(transaction=False)
+            for handle in handles:
+                pipe.lrem(self.processing_key, 1, handle)
+            pipe.zrem(self.deadline_key, *handles)
+            return sum(pipe.execute()[:-1])
+        except Exception as e:
+            self.__get_logger__("ack").error(e)
+            return 0
+
+    def nack(self, handle: bytes) -> bool:
+        try:
+            script = self.quick_cache.__get_script__("queue_requeue", LUA_REQUEUE)
+            return int(script(keys=[self.queue_key, self.processing_key, self.deadline_key], args=[handle])) > 0
+        except Exception as e:
+            self.__get_logger__("nack").error(e)
+            return False
+
+    def requeue_expired(self, limit: int = 1000) -> int:
+        """
+        把超过可见性超时仍未确认的任务放回队列，需要由某个进程定期调用
+        """
+        try:
+            script = self.quick_cache.__get_script__("queue_requeue_expired", LUA_REQUEUE_EXPIRED)
+            return int(script(
+                keys=[self.queue_key, self.processing_key, self.deadline_key],
+                args=[int(time.time() * 1000), int(self.visibility_timeout * 1000), limit]))
+        except Exception as e:
+            self.__get_logger__("requeue_expired").error(e)
+            return 0
+
+    def size(self) -> int:
+        try:
+            return self.quick_cache.redis_db.llen(self.queue_key)
+        except Exception as e:
+            self.__get_logger__("size").error(e)
+            return 0
+
+    def processing_size(self) -> int:
+        try:
+            return self.quick_cache.redis_db.llen(self.processing_key)
+        except Exception as e:
+            self.__get_logger__("processing_size").error(e)
+            return 0
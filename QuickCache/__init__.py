@@ -1,198 +1,1165 @@
 # -*- coding: utf-8 -*-
 import os
-import pickle
+import math
+import stat
+import time
+import random
+import uuid
 import inspect
+import functools
+import threading
 from flask import Flask
-from typing import Optional, Any, Tuple, List
+from concurrent.futures import Future
+from typing import Optional, Any, Tuple, List, Iterator, Dict, Callable, Union
 from mio.sys import redis_db
 from mio.util.Logs import LogHandler
-from mio.util.Helper import get_root_path, read_txt_file
+from mio.util.Helper import get_root_path, read_txt_file, md5
+from .Logger import get_logger
+from .LocalCache import LocalCache
+from .ClientTracking import ClientTracking
+from .ShardedRedis import ShardedRedis
+from .Serializer import Serializer, NOT_FOUND
+from .Metrics import Metrics, StatsdSink
+from .BloomFilter import BloomFilter
+from .CounterBuffer import CounterBuffer
+from .PageCodec import encode_page, is_page, parse_head, decode_page, chunk_keys, stale_chunk_keys, accepts_gzip, \
+    HEAD_SIZE, LUA_UNLINK_STALE_CHUNKS
+
+# 一级缓存、跟踪、布隆过滤器和计数缓冲区都与redis客户端绑定，按(前缀, id(客户端))共享，
+# 同一前缀下传入不同redis_client的实例不会用到其他客户端的状态
+_local_caches: Dict[Tuple[str, int], LocalCache] = {}
+_local_caches_lock = threading.Lock()
+_trackers: Dict[Tuple[str, int], ClientTracking] = {}
+_sharded_clients: Dict[str, ShardedRedis] = {}
+_sharded_clients_lock = threading.Lock()
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+_scripts: Dict[Tuple[int, str], Any] = {}
+_templates: Dict[Tuple[int, str], Tuple[float, Any]] = {}
+_templates_lock = threading.Lock()
+_metrics: Dict[str, Metrics] = {}
+_metrics_lock = threading.Lock()
+_bloom_filters: Dict[Tuple[str, int], Dict[str, BloomFilter]] = {}
+_bloom_filters_lock = threading.Lock()
+_counter_buffers: Dict[Tuple[str, int], CounterBuffer] = {}
+_counter_buffers_lock = threading.Lock()
+# __read_entry__读到负缓存时返回的标记，与"没有缓存"的None区分开
+_MISSING = object()
+
+# 只有持有者才能释放计算锁
+LUA_RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _stable_repr(value: Any) -> str:
+    # dict和set的迭代顺序不稳定，排序后再生成，保证同样的参数得到同样的键
+    if isinstance(value, dict):
+        items: List[str] = sorted(f"{_stable_repr(k)}:{_stable_repr(v)}" for k, v in value.items())
+        return "{" + ",".join(items) + "}"
+    if isinstance(value, (set, frozenset)):
+        return "set(" + ",".join(sorted(_stable_repr(v) for v in value)) + ")"
+    if isinstance(value, list):
+        return "[" + ",".join(_stable_repr(v) for v in value) + "]"
+    if isinstance(value, tuple):
+        return "(" + ",".join(_stable_repr(v) for v in value) + ")"
+    if type(value).__repr__ is object.__repr__:
+        # 默认的repr包含内存地址，每个进程、每个对象都不同，生成的键永远无法命中
+        raise TypeError(f"{type(value).__name__}没有稳定的repr，无法用来生成缓存键，请实现__repr__或传入key_fn")
+    return repr(value)
 
 
 class QuickCache(object):
-    VERSION = "0.2.1"
+    VERSION = "0.3.0"
     redis_key: str
+    redis_db: Any
+    registry_key: Tuple[str, int]
+    local_cache: Optional[LocalCache]
+    serializer: Serializer
+    page_compressor: Optional[str]
+    page_chunk_size: int
+    metrics: Optional[Metrics]
+    bloom_filters: Dict[str, BloomFilter]
+    counter_buffer: CounterBuffer
 
     def __get_logger__(self, name: str) -> LogHandler:
-        name = f"{self.__class__.__name__}.{name}"
-        return LogHandler(name)
+        return get_logger(f"{self.__class__.__name__}.{name}")
 
-    def __init__(self, current_app: Optional[Flask] = None):
+    def __init__(
+            self, current_app: Optional[Flask] = None, local_cache: Optional[LocalCache] = None,
+            serializer: Optional[Serializer] = None, redis_client: Optional[Any] = None
+    ):
         # 如果在cli下使用，则需要显式的传入app
         if current_app is None:
             from flask import current_app
         self.redis_key = current_app.config["REDIS_KEY_PREFIX"]
+        if redis_client is None:
+            redis_client = self.__get_shared_redis_client__(current_app)
+        self.redis_db = redis_client
+        self.registry_key = (self.redis_key, id(self.redis_db))
+        if serializer is None:
+            serializer = Serializer(
+                serializer=current_app.config.get("QUICK_CACHE_SERIALIZER", None),
+                compressor=current_app.config.get("QUICK_CACHE_COMPRESSOR", None),
+                compress_threshold=current_app.config.get("QUICK_CACHE_COMPRESS_THRESHOLD", 1024)
+            )
+        self.serializer = serializer
+        self.page_compressor = current_app.config.get("QUICK_CACHE_PAGE_COMPRESSOR", "gzip")
+        self.page_chunk_size = current_app.config.get("QUICK_CACHE_PAGE_CHUNK_SIZE", 512 * 1024)
+        if local_cache is None:
+            local_cache = self.__get_shared_local_cache__(current_app)
+        self.local_cache = local_cache
+        self.metrics = self.__get_shared_metrics__(current_app)
+        self.bloom_filters = self.__get_shared_bloom_filters__(current_app)
+        self.counter_buffer = self.__get_shared_counter_buffer__(current_app)
 
-    def get_keys(self, key: str, is_full_key: bool = False) -> List[str]:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
+    def __get_shared_redis_client__(self, current_app: Flask) -> Any:
+        # 配置了多个分片时使用一致性哈希分散到各个节点，否则使用mio的全局连接
+        shards: Optional[List[str]] = current_app.config.get("QUICK_CACHE_SHARDS", None)
+        if not shards:
+            return redis_db
+        with _sharded_clients_lock:
+            client: Optional[ShardedRedis] = _sharded_clients.get(self.redis_key)
+            if client is None:
+                client = ShardedRedis.from_urls(
+                    shards, vnodes=current_app.config.get("QUICK_CACHE_SHARD_VNODES", 160),
+                    max_workers=current_app.config.get("QUICK_CACHE_SHARD_WORKERS", None))
+                _sharded_clients[self.redis_key] = client
+            return client
+
+    def __get_shared_local_cache__(self, current_app: Flask) -> Optional[LocalCache]:
+        # 一级缓存需要在同一进程的所有实例间共享，否则每次new出来的实例都是空的
+        max_entries: int = current_app.config.get("QUICK_CACHE_L1_MAX_ENTRIES", 0)
+        if max_entries is None or max_entries <= 0:
+            return None
+        tracking: bool = current_app.config.get("QUICK_CACHE_L1_TRACKING", False)
+        if tracking and isinstance(self.redis_db, ShardedRedis):
+            # 分片模式下各节点的跟踪状态无法统一，只使用过期时间控制一级缓存；在登记一级缓存之前检查，出错时不留下半初始化的状态
+            raise ValueError("QUICK_CACHE_L1_TRACKING不支持与QUICK_CACHE_SHARDS同时使用")
+        with _local_caches_lock:
+            local_cache: Optional[LocalCache] = _local_caches.get(self.registry_key)
+            if local_cache is None:
+                local_cache = LocalCache(
+                    max_entries=max_entries,
+                    max_bytes=current_app.config.get("QUICK_CACHE_L1_MAX_BYTES", 64 * 1024 * 1024),
+                    ttl=current_app.config.get("QUICK_CACHE_L1_TTL", 60)
+                )
+                if tracking:
+                    # 由redis在其他进程写入或删除时主动通知失效；只订阅会进入一级缓存的两个空间，
+                    # 锁、限流、布隆过滤器等高频写入的键不会产生失效通知
+                    tracker: ClientTracking = ClientTracking(
+                        self.redis_db, local_cache, [f"{self.redis_key}:Cache:", f"{self.redis_key}:Namespace:"])
+                    tracker.start()
+                    _trackers[self.registry_key] = tracker
+                _local_caches[self.registry_key] = local_cache
+            return local_cache
+
+    def __get_shared_metrics__(self, current_app: Flask) -> Optional[Metrics]:
+        # 指标在同一进程的所有实例间共享；未开启时不做任何统计
+        if not current_app.config.get("QUICK_CACHE_METRICS", False):
+            return None
+        with _metrics_lock:
+            metrics: Optional[Metrics] = _metrics.get(self.redis_key)
+            if metrics is None:
+                metrics = Metrics()
+                statsd: Optional[str] = current_app.config.get("QUICK_CACHE_STATSD", None)
+                if statsd:
+                    host, _, port = statsd.rpartition(":")
+                    metrics.add_sink(StatsdSink(host or "127.0.0.1", int(port)))
+                _metrics[self.redis_key] = metrics
+            return metrics
+
+    def __get_shared_bloom_filters__(self, current_app: Flask) -> Dict[str, BloomFilter]:
+        # 配置格式为 {命名空间: 预计的键数量}，只对这些命名空间下的缓存生效
+        capacities: Optional[Dict[str, int]] = current_app.config.get("QUICK_CACHE_BLOOM", None)
+        if not capacities:
+            return {}
+        with _bloom_filters_lock:
+            bloom_filters: Optional[Dict[str, BloomFilter]] = _bloom_filters.get(self.registry_key)
+            if bloom_filters is None:
+                bloom_filters = {
+                    namespace: BloomFilter(
+                        self.redis_db, f"{self.redis_key}:Bloom:{{{namespace}}}", capacity,
+                        error_rate=current_app.config.get("QUICK_CACHE_BLOOM_ERROR_RATE", 0.01),
+                        refresh_interval=current_app.config.get("QUICK_CACHE_BLOOM_REFRESH", 60)
+                    ) for namespace, capacity in capacities.items()
+                }
+                _bloom_filters[self.registry_key] = bloom_filters
+            return bloom_filters
+
+    def __get_shared_counter_buffer__(self, current_app: Flask) -> CounterBuffer:
+        # 同一进程的所有实例共用一个缓冲区，后台线程在第一次写入时才启动
+        with _counter_buffers_lock:
+            counter_buffer: Optional[CounterBuffer] = _counter_buffers.get(self.registry_key)
+            if counter_buffer is None:
+                counter_buffer = CounterBuffer(
+                    self.redis_db,
+                    flush_interval=current_app.config.get("QUICK_CACHE_COUNTER_FLUSH_INTERVAL", 5),
+                    max_keys=current_app.config.get("QUICK_CACHE_COUNTER_MAX_KEYS", 1000),
+                    max_loss=current_app.config.get("QUICK_CACHE_COUNTER_MAX_LOSS", 0),
+                    flush_on_exit=current_app.config.get("QUICK_CACHE_COUNTER_FLUSH_ON_EXIT", True),
+                    prepare=lambda pipe, redis_key: self.__bloom_add__(redis_key, pipe=pipe),
+                    flushed=self.__invalidate_local__
+                )
+                _counter_buffers[self.registry_key] = counter_buffer
+            return counter_buffer
+
+    def __tracking_active__(self) -> bool:
+        tracker: Optional[ClientTracking] = _trackers.get(self.registry_key)
+        return tracker is not None and tracker.is_active
+
+    def __invalidate_local__(self, redis_keys: List[str]):
+        if self.local_cache is not None:
+            self.local_cache.delete(*redis_keys)
+
+    def __bloom_for__(self, redis_key: str) -> Optional[BloomFilter]:
+        if not self.bloom_filters or not redis_key.startswith(f"{self.redis_key}:Cache:"):
+            return None
+        return self.bloom_filters.get(self.__namespace__(redis_key))
+
+    def __bloom_add__(self, redis_key: str, pipe: Any = None):
+        bloom: Optional[BloomFilter] = self.__bloom_for__(redis_key)
+        if bloom is not None:
+            bloom.add(redis_key, pipe=pipe)
+
+    def rebuild_bloom(self, namespace: str, batch_size: int = 1000) -> int:
+        """
+        扫描命名空间下现有的键重建布隆过滤器，首次启用时需要调用一次，之后定期调用以清除已过期键的影响
+        """
+        bloom: Optional[BloomFilter] = self.bloom_filters.get(namespace)
+        if bloom is None:
+            raise ValueError(f"命名空间[{namespace}]没有配置布隆过滤器")
+        return bloom.rebuild(self.scan_keys(f"{namespace}:*", count=batch_size))
+
+    def __record_many__(
+            self, op: str, redis_keys: List[str], start: float, sizes: Optional[Dict[str, int]] = None,
+            error: bool = False, is_write: bool = False
+    ):
+        # 批量操作按命名空间分别统计，每个命名空间记一次调用，延迟都取整个批次的耗时；
+        # 读取时sizes中只有命中的键，写入时为每个键写入的字节数
+        if self.metrics is None:
+            return
+        latency: float = time.perf_counter() - start
+        sizes = sizes or {}
+        groups: Dict[str, List[str]] = {}
+        for redis_key in redis_keys:
+            groups.setdefault(self.__namespace__(redis_key), []).append(redis_key)
+        for namespace, group in (groups or {self.__namespace__(""): []}).items():
+            size: int = sum(sizes.get(redis_key, 0) for redis_key in group)
+            if error:
+                self.metrics.record(op, namespace, latency, error=True)
+            elif is_write:
+                self.metrics.record(op, namespace, latency, bytes_out=size)
+            else:
+                hits: int = sum(1 for redis_key in group if redis_key in sizes)
+                self.metrics.record(op, namespace, latency, hits=hits, misses=len(group) - hits, bytes_in=size)
+
+    def __namespace__(self, redis_key: str) -> str:
+        # 取前缀之后的第一段作为命名空间，例如 prefix:Cache:User:1 -> User
+        for prefix in (f"{self.redis_key}:Cache:", f"{self.redis_key}:"):
+            if redis_key.startswith(prefix):
+                redis_key = redis_key[len(prefix):]
+                break
+        return redis_key.lstrip("{").split(":", 1)[0].rstrip("}") or "-"
+
+    def __record__(
+            self, op: str, redis_key: str, start: float, hits: int = 0, misses: int = 0, error: bool = False,
+            bytes_in: int = 0, bytes_out: int = 0
+    ):
+        if self.metrics is None:
+            return
+        self.metrics.record(
+            op, self.__namespace__(redis_key), time.perf_counter() - start, hits=hits, misses=misses, error=error,
+            bytes_in=bytes_in, bytes_out=bytes_out)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        返回各操作按命名空间统计的调用次数、命中、错误、流量和延迟，以及一级缓存的统计
+        """
+        return {
+            "operations": self.metrics.snapshot() if self.metrics is not None else {},
+            "local": self.local_stats(),
+            "bloom": {namespace: bloom.stats() for namespace, bloom in self.bloom_filters.items()},
+        }
+
+    def scan_keys(self, key: str, count: int = 500, is_full_key: bool = False) -> Iterator[str]:
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        # 使用SCAN游标分批迭代，避免KEYS阻塞整个redis实例；SCAN可能返回重复的键
+        cursor: int = 0
         try:
-            redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
-            keys: Optional[List[bytes]] = redis_db.keys(redis_key)
-            return [str(key, encoding="utf-8") for key in keys]
+            while True:
+                cursor, keys = self.redis_db.scan(cursor=cursor, match=redis_key, count=count)
+                for _k in keys:
+                    yield str(_k, encoding="utf-8") if isinstance(_k, bytes) else _k
+                if int(cursor) == 0:
+                    break
         except Exception as e:
-            console_log.error(e)
-            return []
+            self.__get_logger__("scan_keys").error(e)
+
+    def get_keys(self, key: str, is_full_key: bool = False, count: int = 500) -> List[str]:
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        # 去重并保持顺序
+        return list(dict.fromkeys(self.scan_keys(redis_key, count=count, is_full_key=True)))
 
     def lpush(
             self, key: str, value: Optional[Any] = None, expiry: Optional[int] = None, is_full_key: bool = False
     ) -> bool:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return False
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        start: float = time.perf_counter()
         try:
-            redis_db.lpush(redis_key, pickle.dumps(value))
+            val: bytes = self.serializer.dumps(value)
             if expiry and expiry > 0:
-                redis_db.expire(redis_key, time=expiry)
+                # MULTI保证原子性，EXPIRE NX只在键刚创建（还没有过期时间）时生效
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.lpush(redis_key, val)
+                pipe.expire(redis_key, time=expiry, nx=True)
+                pipe.execute()
+            else:
+                self.redis_db.lpush(redis_key, val)
+            self.__record__("lpush", redis_key, start, bytes_out=len(val))
+            return True
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("lpush").error(e)
+            self.__record__("lpush", redis_key, start, error=True)
             return False
 
     def llen(self, key: str, is_full_key: bool = False) -> int:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return 0
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
         try:
-            return redis_db.llen(redis_key)
+            return self.redis_db.llen(redis_key)
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("llen").error(e)
             return 0
 
     def inc_num(
             self, key: str, num: int = 1, expiry: Optional[int] = None, is_full_key: bool = False
     ) -> Optional[int]:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return None
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        start: float = time.perf_counter()
         try:
-            item = redis_db.incr(redis_key, num)
             if expiry and expiry > 0:
-                redis_db.expire(redis_key, time=expiry)
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.incrby(redis_key, num)
+                pipe.expire(redis_key, time=expiry, nx=True)
+                item, _ = pipe.execute()
+            else:
+                item = self.redis_db.incr(redis_key, num)
+            self.__bloom_add__(redis_key)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            self.__record__("inc_num", redis_key, start)
             return item
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("inc_num").error(e)
+            self.__record__("inc_num", redis_key, start, error=True)
             return None
 
     def dec_num(
             self, key: str, num: int = 1, expiry: Optional[int] = None, is_full_key: bool = False
     ) -> Optional[int]:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return None
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        start: float = time.perf_counter()
         try:
-            item = redis_db.decr(redis_key, num)
             if expiry and expiry > 0:
-                redis_db.expire(redis_key, time=expiry)
+                pipe = self.redis_db.pipeline(transaction=True)
+                pipe.decrby(redis_key, num)
+                pipe.expire(redis_key, time=expiry, nx=True)
+                item, _ = pipe.execute()
+            else:
+                item = self.redis_db.decr(redis_key, num)
+            self.__bloom_add__(redis_key)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            self.__record__("dec_num", redis_key, start)
             return item
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("dec_num").error(e)
+            self.__record__("dec_num", redis_key, start, error=True)
             return None
 
+    def inc_num_buffered(
+            self, key: str, num: int = 1, expiry: Optional[int] = None, is_full_key: bool = False
+    ) -> bool:
+        """
+        不需要立即拿到结果的高频计数（例如PV统计）使用，增量在进程内累加后批量写入redis，num为负数即为减少
+        """
+        if key is None or len(key) <= 0:
+            return False
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        self.counter_buffer.add(redis_key, num, expiry)
+        return True
+
+    def flush_counters(self) -> int:
+        """
+        立即写入缓冲中的计数，返回写入的键数量
+        """
+        return self.counter_buffer.flush()
+
     def expire(
             self, key: str, expiry: int, nx: bool = True, xx: bool = False, is_full_key: bool = False
     ) -> bool:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return None
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
         try:
             if expiry <= 0:
-                console_log.error("传入的过期时间[{}]为负数或0".format(expiry))
+                self.__get_logger__("expire").error("传入的过期时间[{}]为负数或0".format(expiry))
                 return False
-            redis_db.expire(redis_key, time=expiry, nx=nx, xx=xx)
+            self.redis_db.expire(redis_key, time=expiry, nx=nx, xx=xx)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
             return True
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("expire").error(e)
             return False
 
-    def rpop(self, key: str, is_full_key: bool = False) -> Optional[Any]:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
+    def rpop(self, key: str, is_full_key: bool = False, count: Optional[int] = None) -> Optional[Any]:
+        # 传入count时一次弹出多个元素（需要redis 6.2+），返回列表
+        if key is None or len(key) <= 0:
+            return None if count is None else []
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        start: float = time.perf_counter()
+        try:
+            if count is not None:
+                vals: Optional[List[bytes]] = self.redis_db.rpop(redis_key, count)
+                self.__record__(
+                    "rpop", redis_key, start, hits=len(vals or []), misses=0 if vals else 1,
+                    bytes_in=sum(len(val) for val in vals or []))
+                return [self.serializer.loads(val) for val in vals] if vals else []
+            val: Optional[bytes] = self.redis_db.rpop(redis_key)
+            if val is None:
+                self.__record__("rpop", redis_key, start, misses=1)
+                return None
+            self.__record__("rpop", redis_key, start, hits=1, bytes_in=len(val))
+            return self.serializer.loads(val)
+        except Exception as e:
+            self.__get_logger__("rpop").error(e)
+            self.__record__("rpop", redis_key, start, error=True)
+            return None if count is None else []
+
+    def brpop(self, key: str, timeout: float = 0, is_full_key: bool = False) -> Optional[Any]:
+        # 阻塞等待直到有元素或超时，timeout为0表示一直等待
         if key is None or len(key) <= 0:
             return None
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
         try:
-            return pickle.loads(redis_db.rpop(redis_key))
+            item: Optional[Tuple[bytes, bytes]] = self.redis_db.brpop(redis_key, timeout=timeout)
+            if item is None:
+                return None
+            return self.serializer.loads(item[1])
         except Exception as e:
-            console_log.error(e)
+            self.__get_logger__("brpop").error(e)
             return None
 
+    def __encode_value__(self, value: Any, is_pickle: bool = True) -> Any:
+        # is_pickle为False时按原样写入字符串，便于其他语言的程序读取
+        return value if not is_pickle else self.serializer.dumps(value)
+
+    def __decode_value__(self, val: bytes, is_pickle: bool = True) -> Any:
+        if is_pickle:
+            return self.serializer.loads(val)
+        return val.decode("utf-8")
+
+    def __set_local__(self, redis_key: str, val: Optional[bytes], pttl: int, version: int):
+        # pttl为-1表示redis中没有过期时间，-2表示键不存在
+        if not val or pttl == -2:
+            self.local_cache.release(redis_key)
+            return
+        self.local_cache.set(redis_key, val, ttl=pttl / 1000 if pttl > 0 else None, version=version)
+
+    def __get_with_local__(self, redis_key: str) -> Optional[bytes]:
+        # 同一次往返中取回值和剩余过期时间，一级缓存的时长不超过redis的过期时间
+        version: int = self.local_cache.begin(redis_key)
+        try:
+            pipe = self.redis_db.pipeline(transaction=False)
+            pipe.get(redis_key)
+            pipe.pttl(redis_key)
+            val, pttl = pipe.execute()
+        except Exception:
+            self.local_cache.release(redis_key)
+            raise
+        self.__set_local__(redis_key, val, pttl, version)
+        return val
+
+    def __fetch__(
+            self, redis_key: str, expiry: int = 0, use_local: bool = True, sliding: bool = False
+    ) -> Optional[bytes]:
+        op: str = "get"
+        start: float = time.perf_counter()
+        try:
+            val: Optional[bytes]
+            if sliding and expiry > 0:
+                # 滑动过期：GETEX读取的同时刷新过期时间，只需一次往返；一级缓存无法刷新redis的过期时间，因此不使用
+                val = self.redis_db.getex(redis_key, ex=expiry)
+            elif self.local_cache is not None and use_local:
+                is_hit, val = self.local_cache.get(redis_key)
+                if is_hit:
+                    # 一级缓存命中单独统计，便于区分redis的延迟
+                    op = "get_local"
+                else:
+                    val = self.__get_with_local__(redis_key)
+            else:
+                val = self.redis_db.get(redis_key)
+        except Exception:
+            self.__record__(op, redis_key, start, error=True)
+            raise
+        if val:
+            self.__record__(op, redis_key, start, hits=1, bytes_in=len(val))
+        else:
+            self.__record__(op, redis_key, start, misses=1)
+        return val
+
     def cache(
             self, key: str, value: Optional[Any] = None, expiry: int = 0, is_full_key: bool = False,
-            is_pickle: bool = True
+            is_pickle: bool = True, use_local: bool = True, sliding: bool = False
     ) -> Tuple[bool, Optional[Any]]:
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return False, None
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        if value is None:
+            # 读取，负缓存与没有缓存一样返回None，需要区分时使用lookup
+            try:
+                val: Optional[bytes] = self.__fetch__(redis_key, expiry, use_local, sliding)
+                if val and val != NOT_FOUND:
+                    return True, self.__decode_value__(val, is_pickle)
+                return True, None
+            except Exception as e:
+                self.__get_logger__("cache").error(e)
+                return False, None
+        start: float = time.perf_counter()
+        try:
+            # 写入
+            val = self.__encode_value__(value, is_pickle)
+            bloom: Optional[BloomFilter] = self.__bloom_for__(redis_key)
+            # 需要更新布隆过滤器时与写入合并在一个pipeline中
+            target: Any = self.redis_db if bloom is None else self.redis_db.pipeline(transaction=False)
+            if expiry > 0:
+                target.setex(redis_key, expiry, val)
+            else:
+                target.set(redis_key, val)
+            if bloom is not None:
+                bloom.add(redis_key, pipe=target)
+                target.execute()
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            self.__record__("set", redis_key, start, bytes_out=len(val))
+            return True, value
+        except Exception as e:
+            self.__get_logger__("cache").error(e)
+            self.__record__("set", redis_key, start, error=True)
+            return False, None
+
+    def lookup(
+            self, key: str, is_full_key: bool = False, is_pickle: bool = True, use_local: bool = True
+    ) -> Tuple[bool, bool, Optional[Any]]:
+        """
+        返回(是否成功, 是否有缓存, 值)；负缓存返回(True, True, None)，表示已确认数据源中不存在
+        """
+        if key is None or len(key) <= 0:
+            return False, False, None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
         try:
-            if value is None:
-                # 读取
-                val: Optional[bytes] = redis_db.get(redis_key)
-                if val:
-                    data: Any
-                    if is_pickle:
-                        data = pickle.loads(val)
-                    else:
-                        data = val.decode("utf-8")
-                    return True, data
+            val: Optional[bytes] = self.__fetch__(redis_key, use_local=use_local)
+            if not val:
+                return True, False, None
+            if val == NOT_FOUND:
+                return True, True, None
+            return True, True, self.__decode_value__(val, is_pickle)
+        except Exception as e:
+            self.__get_logger__("lookup").error(e)
+            return False, False, None
+
+    def cache_not_found(self, key: str, expiry: int, is_full_key: bool = False) -> bool:
+        """
+        写入负缓存，标记数据源中不存在该数据；过期时间通常比正常数据短得多
+        """
+        if key is None or len(key) <= 0 or expiry <= 0:
+            return False
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            self.redis_db.setex(redis_key, expiry, NOT_FOUND)
+            self.__bloom_add__(redis_key)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            return True
+        except Exception as e:
+            self.__get_logger__("cache_not_found").error(e)
+            return False
+
+    def __get_script__(self, name: str, script: str) -> Any:
+        # register_script会优先使用EVALSHA，脚本不存在时自动回退到EVAL；脚本对象与客户端绑定
+        script_key: Tuple[int, str] = (id(self.redis_db), name)
+        if script_key not in _scripts:
+            _scripts[script_key] = self.redis_db.register_script(script)
+        return _scripts[script_key]
+
+    def __read_entry__(
+            self, redis_key: str, is_pickle: bool, early_refresh: bool, beta: float = 1.0, use_local: bool = True
+    ) -> Tuple[Any, bool]:
+        # 提前刷新模式下存的是(value, delta)，并且需要剩余过期时间来计算是否提前刷新；负缓存返回_MISSING
+        # 布隆过滤器的镜像可能落后于其他进程的写入，只在这里（读不到就重新计算）使用，cache等直接读取的方法不受影响
+        bloom: Optional[BloomFilter] = self.__bloom_for__(redis_key)
+        if bloom is not None and not bloom.might_contain(redis_key):
+            self.__record__("get_bloom", redis_key, time.perf_counter(), misses=1)
+            return None, False
+        if not early_refresh:
+            val: Optional[bytes] = self.__fetch__(redis_key, use_local=use_local)
+            if not val:
+                if bloom is not None:
+                    bloom.report_false_positive()
+                return None, False
+            if val == NOT_FOUND:
+                return _MISSING, False
+            return self.__decode_value__(val, is_pickle), False
+        pipe = self.redis_db.pipeline(transaction=False)
+        pipe.get(redis_key)
+        pipe.pttl(redis_key)
+        val, pttl = pipe.execute()
+        if not val:
+            if bloom is not None:
+                bloom.report_false_positive()
+            return None, False
+        if val == NOT_FOUND:
+            return _MISSING, False
+        value, delta = self.__decode_value__(val, True)
+        if value is None or pttl < 0:
+            return value, False
+        # XFetch: delta * beta * -ln(rand) 超过剩余时间时提前刷新，越接近过期、计算越慢，提前的概率越大
+        return value, delta * beta * -math.log(1.0 - random.random()) >= pttl / 1000
+
+    def __load_and_store__(
+            self, redis_key: str, loader: Callable[[], Any], expiry: int, is_pickle: bool, early_refresh: bool,
+            negative_expiry: int = 0
+    ) -> Any:
+        start: float = time.monotonic()
+        value: Any = loader()
+        delta: float = time.monotonic() - start
+        if value is None and negative_expiry > 0:
+            # 数据源中不存在，短时间内缓存这个结果，避免不存在的键反复穿透到数据源
+            self.cache_not_found(redis_key, negative_expiry, is_full_key=True)
+        elif value is not None:
+            if early_refresh:
+                self.cache(redis_key, (value, delta), expiry, is_full_key=True)
+            else:
+                self.cache(redis_key, value, expiry, is_full_key=True, is_pickle=is_pickle)
+        return value
+
+    def __compute_with_lock__(
+            self, redis_key: str, loader: Callable[[], Any], expiry: int, is_pickle: bool, lock_timeout: float,
+            wait_timeout: float, retry_interval: float, early_refresh: bool, stale: Any, negative_expiry: int = 0
+    ) -> Any:
+        # 计算锁放在单独的prefix:Lock:Compute:空间，不会被bulk_remove_cache删掉，也不会出现在get_keys和快照中
+        cache_prefix: str = f"{self.redis_key}:Cache:"
+        lock_name: str = redis_key[len(cache_prefix):] if redis_key.startswith(cache_prefix) else redis_key
+        lock_key: str = f"{self.redis_key}:Lock:Compute:{lock_name}"
+        token: str = uuid.uuid4().hex
+        deadline: float = time.monotonic() + wait_timeout
+        while True:
+            try:
+                is_locked: bool = bool(self.redis_db.set(lock_key, token, nx=True, px=int(lock_timeout * 1000)))
+            except Exception as e:
+                # redis不可用时直接计算，不再等待
+                self.__get_logger__("__compute_with_lock__").error(e)
+                return loader()
+            if is_locked:
+                try:
+                    # 拿到锁之后再确认一次，其他进程可能刚刚写入；提前刷新时旧值仍在，不需要确认
+                    if stale is None:
+                        value, _ = self.__read_entry__(redis_key, is_pickle, early_refresh)
+                        if value is not None:
+                            return value
+                    return self.__load_and_store__(
+                        redis_key, loader, expiry, is_pickle, early_refresh, negative_expiry)
+                finally:
+                    try:
+                        self.__get_script__("release_lock", LUA_RELEASE_LOCK)(keys=[lock_key], args=[token])
+                    except Exception as e:
+                        self.__get_logger__("__compute_with_lock__").error(e)
+            if stale is not None:
+                # 其他进程正在刷新，直接返回旧值
+                return stale
+            if time.monotonic() >= deadline:
+                break
+            time.sleep(retry_interval)
+            value, _ = self.__read_entry__(redis_key, is_pickle, early_refresh)
+            if value is not None:
+                return value
+        # 等待超时，自行计算兜底
+        self.__get_logger__("__compute_with_lock__").warning(f"等待[{redis_key}]的计算结果超时")
+        return self.__load_and_store__(redis_key, loader, expiry, is_pickle, early_refresh, negative_expiry)
+
+    def get_or_compute(
+            self, key: str, loader: Callable[[], Any], expiry: int = 0, is_full_key: bool = False,
+            is_pickle: bool = True, lock_timeout: float = 10, wait_timeout: float = 10, retry_interval: float = 0.05,
+            early_refresh: bool = False, beta: float = 1.0, use_local: bool = True, negative_expiry: int = 0
+    ) -> Tuple[bool, Optional[Any]]:
+        """
+        negative_expiry大于0时，loader返回None的结果也会缓存这么多秒，期间直接返回None而不再调用loader
+        """
+        if key is None or len(key) <= 0:
+            return False, None
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        stale: Any = None
+        try:
+            value, need_refresh = self.__read_entry__(redis_key, is_pickle, early_refresh, beta, use_local)
+            if value is _MISSING:
                 return True, None
+            if value is not None:
+                if not need_refresh:
+                    return True, value
+                stale = value
+        except Exception as e:
+            self.__get_logger__("get_or_compute").error(e)
+        # 同一进程内只有一个调用者去计算，其余的等待它的结果
+        with _inflight_lock:
+            future: Optional[Future] = _inflight.get(redis_key)
+            is_leader: bool = future is None
+            if is_leader:
+                future = Future()
+                _inflight[redis_key] = future
+        if not is_leader:
+            if stale is not None:
+                return True, stale
+            try:
+                return True, future.result(timeout=wait_timeout)
+            except Exception as e:
+                self.__get_logger__("get_or_compute").error(e)
+                return False, None
+        try:
+            # 跨进程则通过redis上的短锁保证只有一个调用者计算
+            value = self.__compute_with_lock__(
+                redis_key, loader, expiry, is_pickle, lock_timeout, wait_timeout, retry_interval, early_refresh,
+                stale, negative_expiry)
+            if value is _MISSING:
+                value = None
+            future.set_result(value)
+            return True, value
+        except Exception as e:
+            future.set_exception(e)
+            self.__get_logger__("get_or_compute").error(e)
+            if stale is not None:
+                return True, stale
+            return False, None
+        finally:
+            with _inflight_lock:
+                _inflight.pop(redis_key, None)
+
+    def memoize(
+            self, expiry: int = 0, key_fn: Optional[Callable[..., str]] = None, namespace: Optional[str] = None,
+            use_local: bool = True, early_refresh: bool = False, negative_expiry: int = 0
+    ) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+        def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+            func_namespace: str = namespace if namespace is not None else f"{func.__module__}.{func.__qualname__}"
+            signature: inspect.Signature = inspect.signature(func)
+
+            def make_key(*args, **kwargs) -> str:
+                if key_fn is not None:
+                    arg_key: str = key_fn(*args, **kwargs)
+                else:
+                    # 按函数签名绑定参数，位置参数和关键字参数的写法不影响生成的键
+                    bound: inspect.BoundArguments = signature.bind(*args, **kwargs)
+                    bound.apply_defaults()
+                    # 方法的self/cls同样参与生成键，实例没有实现__repr__时由_stable_repr抛出TypeError，避免不同实例共用结果
+                    arg_key = md5(_stable_repr(dict(bound.arguments)))
+                return f"Memoize:{func_namespace}:{arg_key}"
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs) -> Any:
+                errors: List[Exception] = []
+
+                def loader() -> Any:
+                    try:
+                        return func(*args, **kwargs)
+                    except Exception as e:
+                        errors.append(e)
+                        raise
+
+                is_ok, value = self.get_or_compute(
+                    make_key(*args, **kwargs), loader, expiry, use_local=use_local, early_refresh=early_refresh,
+                    negative_expiry=negative_expiry)
+                if len(errors) > 0:
+                    # 被装饰函数自身的异常需要原样抛给调用方
+                    raise errors[0]
+                if not is_ok:
+                    return func(*args, **kwargs)
+                return value
+
+            def invalidate(*args, **kwargs):
+                self.remove_cache(make_key(*args, **kwargs))
+
+            def invalidate_all() -> int:
+                return self.bulk_remove_cache(f"Memoize:{func_namespace}")
+
+            wrapper.make_key = make_key
+            wrapper.invalidate = invalidate
+            wrapper.invalidate_all = invalidate_all
+            return wrapper
+
+        return decorator
+
+    def get_many(
+            self, keys: List[str], is_full_key: bool = False, is_pickle: bool = True, use_local: bool = True
+    ) -> Dict[str, Tuple[bool, Optional[Any]]]:
+        result: Dict[str, Tuple[bool, Optional[Any]]] = {}
+        keys = [key for key in keys if key is not None and len(key) > 0]
+        if len(keys) <= 0:
+            return result
+        redis_keys: List[str] = [f"{self.redis_key}:Cache:{key}" if not is_full_key else key for key in keys]
+        values: Dict[str, Optional[bytes]] = {}
+        start: float = time.perf_counter()
+        try:
+            if self.local_cache is not None and use_local:
+                for redis_key in redis_keys:
+                    is_hit, val = self.local_cache.get(redis_key)
+                    if is_hit:
+                        values[redis_key] = val
+                missing: List[str] = [redis_key for redis_key in redis_keys if redis_key not in values]
+                if len(missing) > 0:
+                    versions: List[int] = [self.local_cache.begin(redis_key) for redis_key in missing]
+                    try:
+                        pipe = self.redis_db.pipeline(transaction=False)
+                        pipe.mget(missing)
+                        for redis_key in missing:
+                            pipe.pttl(redis_key)
+                        fetched = pipe.execute()
+                    except Exception:
+                        for redis_key in missing:
+                            self.local_cache.release(redis_key)
+                        raise
+                    for redis_key, val, pttl, version in zip(missing, fetched[0], fetched[1:], versions):
+                        values[redis_key] = val
+                        self.__set_local__(redis_key, val, pttl, version)
             else:
-                # 写入
-                val = value if not is_pickle else pickle.dumps(value)
+                values = dict(zip(redis_keys, self.redis_db.mget(redis_keys)))
+        except Exception as e:
+            self.__get_logger__("get_many").error(e)
+            self.__record_many__("get_many", redis_keys, start, error=True)
+            return {key: (False, None) for key in keys}
+        self.__record_many__(
+            "get_many", redis_keys, start, sizes={redis_key: len(val) for redis_key, val in values.items() if val})
+        for key, redis_key in zip(keys, redis_keys):
+            val: Optional[bytes] = values.get(redis_key)
+            if not val or val == NOT_FOUND:
+                result[key] = (True, None)
+                continue
+            try:
+                result[key] = (True, self.__decode_value__(val, is_pickle))
+            except Exception as e:
+                # 单个键解码失败不影响其他键
+                self.__get_logger__("get_many").error(e)
+                result[key] = (False, None)
+        return result
+
+    def set_many(
+            self, mapping: Dict[str, Any], expiry: int = 0, is_full_key: bool = False, is_pickle: bool = True
+    ) -> bool:
+        if mapping is None or len(mapping) <= 0:
+            return False
+        start: float = time.perf_counter()
+        redis_keys: List[str] = []
+        sizes: Dict[str, int] = {}
+        try:
+            pipe = self.redis_db.pipeline(transaction=False)
+            for key, value in mapping.items():
+                if key is None or len(key) <= 0 or value is None:
+                    continue
+                redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+                val = self.__encode_value__(value, is_pickle)
                 if expiry > 0:
-                    redis_db.setex(redis_key, expiry, val)
+                    pipe.setex(redis_key, expiry, val)
                 else:
-                    redis_db.set(redis_key, val)
-                return True, value
+                    pipe.set(redis_key, val)
+                self.__bloom_add__(redis_key, pipe=pipe)
+                redis_keys.append(redis_key)
+                sizes[redis_key] = len(val)
+            pipe.execute()
+            if self.local_cache is not None:
+                self.local_cache.delete(*redis_keys)
+            self.__record_many__("set_many", redis_keys, start, sizes=sizes, is_write=True)
+            return True
         except Exception as e:
-            console_log.error(e)
-            return False, None
+            self.__get_logger__("set_many").error(e)
+            self.__record_many__("set_many", redis_keys, start, error=True)
+            return False
 
     def remove_cache(self, key: str, is_full_key: bool = False):
-        console_log = self.__get_logger__(inspect.stack()[0].function)
         if key is None or len(key) <= 0:
             return
         redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        start: float = time.perf_counter()
         try:
-            redis_db.delete(redis_key)
+            self.redis_db.delete(redis_key)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            self.__record__("remove", redis_key, start)
         except Exception as e:
-            console_log.debug(e)
+            self.__get_logger__("remove_cache").debug(e)
+            self.__record__("remove", redis_key, start, error=True)
 
-    def bulk_remove_cache(self, key: str, is_full_key: bool = False):
-        console_log = self.__get_logger__(inspect.stack()[0].function)
+    def __unlink_keys__(self, keys: List[str]) -> int:
+        # 一个批次只走一次pipeline，UNLINK由redis在后台线程释放内存
+        pipe = self.redis_db.pipeline(transaction=False)
+        for _k in keys:
+            pipe.unlink(_k)
+        removed: int = sum(pipe.execute())
+        if self.local_cache is not None:
+            self.local_cache.delete(*keys)
+        return removed
+
+    def bulk_remove_cache(self, key: str, is_full_key: bool = False, batch_size: int = 500) -> int:
         if key is None or len(key) <= 0:
-            return
+            return 0
         redis_key: str = f"{self.redis_key}:Cache:{key}:*" if not is_full_key else key
+        removed: int = 0
+        start: float = time.perf_counter()
         try:
-            keys: List[str] = self.get_keys(redis_key, is_full_key=True)
-            for _k in keys:
-                redis_db.delete(_k)
+            batch: List[str] = []
+            for _k in self.scan_keys(redis_key, count=batch_size, is_full_key=True):
+                batch.append(_k)
+                if len(batch) >= batch_size:
+                    removed += self.__unlink_keys__(batch)
+                    batch = []
+            if len(batch) > 0:
+                removed += self.__unlink_keys__(batch)
+            self.__record__("bulk_remove", redis_key, start)
         except Exception as e:
-            console_log.debug(e)
+            self.__get_logger__("bulk_remove_cache").debug(e)
+            self.__record__("bulk_remove", redis_key, start, error=True)
+        return removed
+
+    def namespace_version(self, namespace: str) -> int:
+        # 版本号按普通字符串缓存；只有CLIENT TRACKING生效时才读一级缓存，否则其他进程失效命名空间后要等一级缓存过期才能看到
+        _, version = self.cache(
+            f"{self.redis_key}:Namespace:{namespace}", is_full_key=True, is_pickle=False,
+            use_local=self.__tracking_active__())
+        return int(version) if version else 0
+
+    def namespace_key(self, namespace: str, key: str) -> str:
+        """
+        生成带命名空间版本号的键，可以直接传给cache等方法；命名空间失效后旧版本的键不会再被读到，等待自然过期即可
+        """
+        return f"{namespace}:v{self.namespace_version(namespace)}:{key}"
+
+    def invalidate_namespace(self, namespace: str) -> Optional[int]:
+        redis_key: str = f"{self.redis_key}:Namespace:{namespace}"
+        try:
+            version: int = self.redis_db.incr(redis_key)
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            return version
+        except Exception as e:
+            self.__get_logger__("invalidate_namespace").error(e)
+            return None
+
+    def cache_tagged(
+            self, key: str, value: Any, tags: List[str], expiry: int = 0, is_full_key: bool = False,
+            is_pickle: bool = True
+    ) -> bool:
+        if key is None or len(key) <= 0 or value is None:
+            return False
+        redis_key: str = f"{self.redis_key}:Cache:{key}" if not is_full_key else key
+        try:
+            pipe = self.redis_db.pipeline(transaction=True)
+            val = self.__encode_value__(value, is_pickle)
+            if expiry > 0:
+                pipe.setex(redis_key, expiry, val)
+            else:
+                pipe.set(redis_key, val)
+            self.__bloom_add__(redis_key, pipe=pipe)
+            now: float = time.time()
+            for tag in tags:
+                # 标签索引为有序集合，分数是条目的过期时间，每次写入时顺便清掉已经过期的条目，集合不会无限增长
+                tag_key: str = f"{self.redis_key}:Tags:{tag}"
+                pipe.zadd(tag_key, {redis_key: now + expiry if expiry > 0 else float("inf")})
+                pipe.zremrangebyscore(tag_key, "-inf", now)
+                if expiry > 0:
+                    # 标签索引的过期时间取其中条目的最大值
+                    pipe.expire(tag_key, expiry, nx=True)
+                    pipe.expire(tag_key, expiry, gt=True)
+                else:
+                    pipe.persist(tag_key)
+            pipe.execute()
+            if self.local_cache is not None:
+                self.local_cache.delete(redis_key)
+            return True
+        except Exception as e:
+            self.__get_logger__("cache_tagged").error(e)
+            return False
+
+    def invalidate_tags(self, *tags: str, batch_size: int = 500) -> int:
+        removed: int = 0
+        for tag in tags:
+            tag_key: str = f"{self.redis_key}:Tags:{tag}"
+            try:
+                batch: List[str] = []
+                for member, _ in self.redis_db.zscan_iter(tag_key, count=batch_size):
+                    batch.append(str(member, encoding="utf-8") if isinstance(member, bytes) else member)
+                    if len(batch) >= batch_size:
+                        removed += self.__unlink_keys__(batch)
+                        batch = []
+                if len(batch) > 0:
+                    removed += self.__unlink_keys__(batch)
+                self.redis_db.unlink(tag_key)
+            except Exception as e:
+                self.__get_logger__("invalidate_tags").error(e)
+        return removed
+
+    def lock(
+            self, name: str, ttl: float = 30, timeout: Optional[float] = None, auto_renew: bool = False
+    ) -> Any:
+        """
+        返回分布式锁，用法：with quick_cache.lock("name", ttl=10) as lock: ...，lock.fencing_token为本次的栅栏令牌
+        """
+        from .DistributedLock import DistributedLock
+        return DistributedLock(name, ttl=ttl, timeout=timeout, auto_renew=auto_renew, quick_cache=self)
+
+    def local_stats(self) -> Optional[Dict[str, Any]]:
+        if self.local_cache is None:
+            return None
+        return self.local_cache.stats()
+
+    @staticmethod
+    def __get_template__(template_filename: str) -> Optional[Any]:
+        # 编译好的模板按文件名和修改时间缓存在进程内，模板文件更新后自动重新编译
+        from flask import current_app
+        try:
+            file_stat: os.stat_result = os.stat(template_filename)
+        except OSError:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        jinja_env = current_app.jinja_env
+        cache_key: Tuple[int, str] = (id(jinja_env), template_filename)
+        with _templates_lock:
+            item: Optional[Tuple[float, Any]] = _templates.get(cache_key)
+        if item is not None and item[0] == file_stat.st_mtime:
+            return item[1]
+        template = jinja_env.from_string(read_txt_file(template_filename))
+        with _templates_lock:
+            _templates[cache_key] = (file_stat.st_mtime, template)
+        return template
+
+    def warm_templates(self) -> int:
+        """
+        预先编译web/template下的所有模板，需要在app上下文中调用
+        """
+        console_log = self.__get_logger__(inspect.stack()[0].function)
+        root_path: str = os.path.join(get_root_path(), "web", "template")
+        count: int = 0
+        for dir_path, _, filenames in os.walk(root_path):
+            for filename in filenames:
+                try:
+                    if self.__get_template__(os.path.join(dir_path, filename)) is not None:
+                        count += 1
+                except Exception as e:
+                    console_log.error(f"{filename}: {e}")
+        return count
+
+    def __store_page__(self, redis_key: str, text: str, expiry: int) -> int:
+        head, chunks = encode_page(text, self.page_compressor, self.page_chunk_size)
+        # 分块和头部在同一个事务中写入，读取方不会看到只写了一半的页面
+        pipe = self.redis_db.pipeline(transaction=True)
+        for _k, chunk in zip(chunk_keys(redis_key, head), chunks):
+            if expiry > 0:
+                pipe.setex(_k, expiry, chunk)
+            else:
+                pipe.set(_k, chunk)
+        # 分块的键名带有代数，不会覆盖正在被读取的旧分块；同时取回旧头部，用来找出需要删除的旧分块
+        pipe.set(redis_key, head, ex=expiry if expiry > 0 else None, get=True)
+        old_head: Optional[bytes] = pipe.execute()[-1]
+        # 清理被替换掉的旧分块；期间其他进程又写回了旧的那一份时保留
+        generation, stale = stale_chunk_keys(redis_key, old_head, head)
+        if len(stale) > 0:
+            script = self.__get_script__("page_unlink_stale_chunks", LUA_UNLINK_STALE_CHUNKS)
+            script(keys=[redis_key, *stale], args=[HEAD_SIZE, generation])
+        return len(head) + sum(len(chunk) for chunk in chunks)
+
+    def __load_page__(self, redis_key: str, expiry: int, gzipped: bool) -> Optional[Union[str, bytes]]:
+        head: Optional[bytes] = self.redis_db.getex(redis_key, ex=expiry) if expiry > 0 else self.redis_db.get(redis_key)
+        if not head or not is_page(head):
+            return None
+        compression, chunk_count, data = parse_head(head)
+        if chunk_count > 0:
+            # 按头部中的代数读取分块，头部被其他进程替换时旧分块要么还在，要么已被删除（视为未命中），不会拼出混合的数据
+            keys: List[str] = chunk_keys(redis_key, head)
+            pipe = self.redis_db.pipeline(transaction=False)
+            pipe.mget(keys)
+            if expiry > 0:
+                for _k in keys:
+                    pipe.expire(_k, expiry)
+            chunks: List[Optional[bytes]] = pipe.execute()[0]
+            if any(chunk is None for chunk in chunks):
+                return None
+            data = b"".join(chunks)
+        return decode_page(compression, data, gzipped)
 
     def cache_page(
             self, key: str, template_filename: str, expiry: int = 3600, is_full_key: bool = False, **kwargs
     ) -> Optional[str]:
-        from flask import render_template_string
+        from flask import current_app
         redis_key: str = f"{self.redis_key}:Page:Cache:{key}" if not is_full_key else key
         root_path: str = os.path.join(get_root_path(), "web", "template")
         template_filename = root_path + os.path.sep + template_filename
-        if not os.path.isfile(template_filename):
+        template = self.__get_template__(template_filename)
+        if template is None:
             return None
-        # 开始渲染
-        text: str = read_txt_file(template_filename)
-        text = render_template_string(text, **kwargs)
-        self.cache(redis_key, text, expiry)
+        # 开始渲染，与render_template_string一样注入上下文处理器提供的变量
+        context: Dict[str, Any] = dict(kwargs)
+        current_app.update_template_context(context)
+        text: str = template.render(context)
+        start: float = time.perf_counter()
+        try:
+            size: int = self.__store_page__(redis_key, text, expiry)
+            self.__record__("cache_page", redis_key, start, bytes_out=size)
+        except Exception as e:
+            self.__get_logger__("cache_page").error(e)
+            self.__record__("cache_page", redis_key, start, error=True)
         return text
 
-    def read_page(self, key: str, expiry: int = 3600, is_full_key: bool = False) -> Optional[str]:
+    def read_page(
+            self, key: str, expiry: int = 3600, is_full_key: bool = False, gzipped: bool = False
+    ) -> Optional[Union[str, bytes]]:
+        """
+        gzipped为True时返回gzip压缩后的字节，可以直接作为Content-Encoding: gzip的响应体
+        """
         redis_key: str = f"{self.redis_key}:Page:Cache:{key}" if not is_full_key else key
-        is_ok, text = self.cache(redis_key)
-        if not is_ok or text is None:
+        start: float = time.perf_counter()
+        try:
+            # 读取的同时刷新缓存的过期时间，不再重新上传整个页面
+            page: Optional[Union[str, bytes]] = self.__load_page__(redis_key, expiry, gzipped)
+            if page is None:
+                self.__record__("read_page", redis_key, start, misses=1)
+            else:
+                self.__record__("read_page", redis_key, start, hits=1, bytes_in=len(page))
+            return page
+        except Exception as e:
+            self.__get_logger__("read_page").error(e)
+            self.__record__("read_page", redis_key, start, error=True)
             return None
-        # 刷新缓存
-        self.cache(redis_key, text, expiry)
-        return text
+
+    def page_response(self, key: str, expiry: int = 3600, is_full_key: bool = False) -> Optional[Any]:
+        """
+        按客户端的Accept-Encoding返回flask的Response，支持gzip时直接返回缓存中的压缩数据
+        """
+        from flask import request, make_response
+        gzipped: bool = accepts_gzip(request.headers.get("Accept-Encoding", ""))
+        body: Optional[Union[str, bytes]] = self.read_page(key, expiry, is_full_key=is_full_key, gzipped=gzipped)
+        if body is None:
+            return None
+        response = make_response(body)
+        response.headers["Content-Type"] = "text/html; charset=utf-8"
+        response.headers["Vary"] = "Accept-Encoding"
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+        return response